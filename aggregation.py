@@ -0,0 +1,130 @@
+#!/usr/bin/python
+# Filename: aggregation.py
+
+# Windowed deduplication of spots: the spots of the same DX station on (about) the same
+# frequency within a time window are merged into one Activity which counts its spotters
+# and their continents.
+
+from collections import OrderedDict
+from datetime import timedelta
+
+#------------------CONSTANTS --------------------
+WINDOW = 600 #seconds; an activity ends when it hasn't been spotted for this long
+TOLERANCE = 1.0 #kHz; spots of the same call which are at most this far apart are merged
+
+class Activity(object):
+	""" Distinct activity of a DX station: all spots of dx_call around frequency (the frequency
+	of the first spot) which are no more than the window apart"""
+	__slots__ = ('dx_call', 'dx_station', 'frequency', 'band', 'mode', 'first_seen', 'last_seen', 'count',
+		'spotters', 'continents')
+
+	def __init__(self, spot):
+		self.dx_call = spot.dx_call
+		self.dx_station = spot.dx_station
+		self.frequency = spot.frequency
+		self.band = spot.band
+		self.mode = spot.mode
+		self.first_seen = spot.time
+		self.last_seen = spot.time
+		self.count = 0 #number of spots
+		self.spotters = set() #distinct spotter calls
+		self.continents = {} #continent of the spotter -> distinct spotters
+
+	def __repr__(self):
+		return("<Activity %s %.1f kHz, %d spots by %d spotters>" % (self.dx_call, self.frequency, self.count, len(self.spotters)))
+
+	def add(self, spot):
+		self.count += 1
+		if spot.time > self.last_seen:
+			self.last_seen = spot.time
+		spotter = spot.spotter_call
+		if spotter not in self.spotters:
+			self.spotters.add(spotter)
+			continent = spot.spotter_station.continent
+			self.continents[continent] = self.continents.get(continent, 0) + 1
+
+
+class SpotAggregator(object):
+	""" Merges spots into Activity objects. The open activities are kept in a hash of
+	(dx_call, frequency bucket) which is ordered by the time they have last been spotted, so
+	both the lookup of a spot and the eviction of the activities which have ended cost O(1)
+	(amortized). The spots are expected in about chronological order. on_close(activity) is
+	called for every activity when it ends"""
+
+	def __init__(self, window=WINDOW, tolerance=TOLERANCE, on_close=None):
+		self.window = timedelta(seconds=window)
+		self.tolerance = float(tolerance)
+		self.on_close = on_close
+		self.spots = 0
+		self.duplicates = 0
+		self._activities = OrderedDict()
+		if hasattr(self._activities, "move_to_end"):
+			self._touch = self._activities.move_to_end
+		else: #Python 2
+			self._touch = self.__reinsert
+
+	def __reinsert(self, key):
+		self._activities[key] = self._activities.pop(key)
+
+	def __len__(self):
+		return(len(self._activities))
+
+	def __iter__(self):
+		"""open activities, least recently spotted first"""
+		return(iter(list(self._activities.values())))
+
+	def add(self, spot):
+		""" Merge a spot into its activity and return the activity; activity.count == 1 for
+		the first spot of a new activity. Invalid spots are ignored (returns None)"""
+		if not spot.valid:
+			return(None)
+		self.spots += 1
+		self.expire(spot.time)
+		call = spot.dx_call
+		bucket = int(spot.frequency // self.tolerance)
+		activity = None
+		for key in ((call, bucket), (call, bucket - 1), (call, bucket + 1)):
+			candidate = self._activities.get(key)
+			if candidate is not None and abs(candidate.frequency - spot.frequency) <= self.tolerance:
+				activity = candidate
+				self.duplicates += 1
+				break
+		else:
+			key = (call, bucket)
+			activity = self._activities[key] = Activity(spot)
+		activity.add(spot)
+		self._touch(key)
+		return(activity)
+
+	def dedup(self, spots):
+		"""generator which yields only the first spot of every activity"""
+		for spot in spots:
+			activity = self.add(spot)
+			if activity is not None and activity.count == 1:
+				yield spot
+
+	def expire(self, now):
+		"""end all activities which haven't been spotted within the window before now; returns them"""
+		limit = now - self.window
+		closed = []
+		while self._activities:
+			key = next(iter(self._activities))
+			activity = self._activities[key]
+			if activity.last_seen > limit:
+				break
+			del self._activities[key]
+			closed.append(activity)
+			if self.on_close is not None:
+				self.on_close(activity)
+		return(closed)
+
+	def flush(self):
+		"""end all open activities (e.g. at the end of an archive); returns them"""
+		closed = list(self._activities.values())
+		self._activities.clear()
+		if self.on_close is not None:
+			for activity in closed:
+				self.on_close(activity)
+		return(closed)
+
+# End of aggregation.py
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+# Filename: bandplan.py
+
+import os
+from bisect import bisect_left
+
+#------------------CONSTANTS --------------------
+BANDPLAN_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bandplan.csv")
+UNKNOWN_MODE = "unknown"
+
+def load_band_plan(filename=BANDPLAN_FILE, region="default"):
+	""" Load the segments of one region from a band plan file (region,band,lower,upper,mode per line)"""
+	segments = []
+	with open(filename) as f:
+		for line in f:
+			line = line.strip()
+			if not line or line.startswith("#"):
+				continue
+			fields = [field.strip() for field in line.split(",")]
+			if len(fields) != 5:
+				raise ValueError("Invalid line in band plan " + filename + ": " + line)
+			if fields[0] != region:
+				continue
+			band = float(fields[1]) if "." in fields[1] else int(fields[1])
+			segments.append((float(fields[2]), float(fields[3]), band, fields[4]))
+	if not segments:
+		raise ValueError("Region '" + str(region) + "' not found in band plan " + filename)
+	return(BandPlan(segments, region))
+
+
+class BandPlan(object):
+	"""Band plan compiled into sorted boundary arrays; a frequency (kHz) is mapped
+	to (band, mode) by a binary search instead of comparing it against every range"""
+
+	def __init__(self, segments, region=None):
+		self.region = region
+		segments = sorted(segments)
+		self._lowers = []
+		self._uppers = []
+		self._results = []
+		for lower, upper, band, mode in segments:
+			if lower > upper:
+				raise ValueError("Band plan segment %s-%s: lower edge above upper edge" % (lower, upper))
+			if self._uppers and lower < self._uppers[-1]:
+				raise ValueError("Band plan segment %s-%s overlaps the previous segment" % (lower, upper))
+			self._lowers.append(lower)
+			self._uppers.append(upper)
+			self._results.append((band, mode))
+		self._unknown = (0, UNKNOWN_MODE)
+		self.modes = [UNKNOWN_MODE] + sorted(set(mode for band, mode in self._results if mode != UNKNOWN_MODE))
+		self._vectors = None
+
+	def __len__(self):
+		return(len(self._results))
+
+	def lookup(self, freq):
+		"""(band, mode) of a frequency in kHz; (0, "unknown") if it is outside of the band plan"""
+		i = bisect_left(self._uppers, freq)
+		if i < len(self._uppers) and self._lowers[i] <= freq:
+			return(self._results[i])
+		return(self._unknown)
+
+	def lookup_array(self, freqs):
+		""" Vectorized lookup for a NumPy array of frequencies in kHz. Returns an array of bands
+		(0 outside of the band plan) and an array of mode codes; self.modes[code] is the mode name"""
+		import numpy
+		freqs = numpy.asarray(freqs, dtype=float)
+		if not self._results:
+			return(numpy.zeros(freqs.shape), numpy.zeros(freqs.shape, dtype=numpy.int8))
+		if self._vectors is None:
+			self._vectors = (
+				numpy.array(self._lowers, dtype=float),
+				numpy.array(self._uppers, dtype=float),
+				numpy.array([band for band, mode in self._results], dtype=float),
+				numpy.array([self.modes.index(mode) for band, mode in self._results], dtype=numpy.int8))
+		lowers, uppers, bands, modes = self._vectors
+		i = numpy.searchsorted(uppers, freqs, side="left")
+		valid = i < len(uppers)
+		i = numpy.minimum(i, len(uppers) - 1)
+		valid &= lowers[i] <= freqs
+		return(numpy.where(valid, bands[i], 0.0), numpy.where(valid, modes[i], 0).astype(numpy.int8))
+
+# End of bandplan.py
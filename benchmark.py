@@ -0,0 +1,385 @@
+#!/usr/bin/python
+# Filename: benchmark.py
+
+# Benchmarks for the classes in spot_processing.py
+# The suite decodes a corpus of cluster lines ("DX de", WWV/WCY and "To ALL de") and measures
+# lines per second, the p50 / p99 latency per line, the allocated memory blocks per line and the
+# peak RSS for Spot, Station, WWV, Comment and the loading of the Country File. The results can
+# be written to a JSON file and compared with those of another commit. The micro benchmarks
+# decode the fixtures of testing.py over and over and print the cost per line.
+
+# Execute the benchmark from command line:
+#	"python benchmark.py [--corpus cluster.log] [--lines 300000] [--json results.json]"
+#	"python benchmark.py --compare before.json after.json"
+#	"python benchmark.py --micro"
+
+import gc
+import os
+import sys
+import json
+import random
+import platform
+import argparse
+import subprocess
+import multiprocessing
+import shutil
+import tempfile
+import time
+import timeit
+import plistlib
+try:
+	import tracemalloc
+except ImportError: #Python 2
+	tracemalloc = None
+try:
+	import resource
+except ImportError: #Windows
+	resource = None
+import testing #also configures the logger
+from spot_processing import Station, Spot, WWV, Comment, parse_line
+from cty import read_country_file, compile_cty, load_snapshot, load_cty
+
+CORPUS_LINES = 300000
+CORPUS_SEED = 1
+REPEAT = 3 #throughput runs of which the fastest counts
+LATENCY_SAMPLE = 20000 #lines which are timed one by one for the percentiles
+REGRESSION = 0.10 #relative change which --compare reports as regression
+STATION_CALLS = ["DH1TW", "HC2/DH1TW/P", "DH1TW/QRP", "VP2E/AL1O/P", "W3LPL/5", "DB0SUE-10", "RW3DQC/1/P", "CD4300", "F/ON5OF", "QSL"]
+
+def fixtures(name):
+	"""all fixture strings of testing.py whose variable name starts with name"""
+	return([getattr(testing, attr) for attr in sorted(dir(testing)) if attr.startswith(name) and isinstance(getattr(testing, attr), str)])
+
+def cost_per_line(cls, lines, number):
+	"""average time in microseconds to decode one line"""
+	total = timeit.timeit(lambda: [cls(line) for line in lines], number=number)
+	return(total / number / len(lines) * 1e6)
+
+def spot_lines(number, calls=3000, seed=1):
+	"""synthetic "DX de" lines; spotters and DX stations are drawn from a pool of calls like in a real feed"""
+	rng = random.Random(seed)
+	prefixes = sorted(prefix for prefix in Station.dxcc if prefix.isalpha() and len(prefix) <= 2)
+	pool = ["%s%d%s" % (rng.choice(prefixes), rng.randint(0, 9), "".join(rng.choice("ABCDEFGHIJKLMNOPQRSTUVWXYZ") for i in range(rng.randint(1, 3))))
+		for i in range(calls)]
+	freqs = [1820.0, 3525.0, 7012.0, 10115.0, 14025.0, 14205.0, 18075.0, 21004.8, 24895.0, 28015.0, 50105.0]
+	return(["DX de %-9s%9.1f  %-12s %-30s %04dZ" % (rng.choice(pool) + ":", rng.choice(freqs) + rng.randint(0, 40) / 10.0,
+		rng.choice(pool), "CQ TEST 599", rng.randint(0, 23) * 100 + rng.randint(0, 59)) for i in range(number)])
+
+def memory_per_spot(number=20000):
+	"""bytes allocated per Spot which is kept in memory (including the station cache)"""
+	if tracemalloc is None:
+		return(None)
+	lines = spot_lines(number)
+	Station.cache.clear()
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	spots = [Spot(line) for line in lines]
+	after = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return(float(after - before) / len(spots))
+
+def spot_throughput(number=20000):
+	"""lines per second decoded by Spot with the regular expressions, the fast path and the fast path on bytes"""
+	lines = spot_lines(number)
+	raw_lines = [line.encode("ascii") for line in lines]
+	fast_path = Spot.fast_path
+	results = []
+	try:
+		for name, enabled, data in (("regex", False, lines), ("fast path", True, lines), ("fast bytes", True, raw_lines)):
+			Spot.fast_path = enabled
+			[Spot(line) for line in data[:1000]] #warm up the station cache
+			seconds = min(timeit.repeat(lambda: [Spot(line) for line in data], number=1, repeat=3))
+			results.append((name, len(data) / seconds))
+	finally:
+		Spot.fast_path = fast_path
+	return(results)
+
+def _read_plist_tree(filename):
+	"""former loader: plistlib builds the whole document and a dict for every entry"""
+	if hasattr(plistlib, "load"):
+		with open(filename, "rb") as f:
+			return(plistlib.load(f))
+	return(plistlib.readPlist(filename))
+
+def load_cost(loader, filename):
+	"""(seconds, peak bytes, retained bytes) of loading a Country File; bytes are None without tracemalloc"""
+	gc.collect()
+	start = time.time()
+	loader(filename)
+	seconds = time.time() - start
+	if tracemalloc is None:
+		return(seconds, None, None)
+	tracemalloc.start() #measured in a second run, tracing slows down the loader
+	country_list = loader(filename)
+	retained, peak = tracemalloc.get_traced_memory()
+	tracemalloc.stop()
+	del country_list
+	return(seconds, peak, retained)
+
+def cty_loaders(filename="cty.plist"):
+	"""load the Country File with the former plistlib loader, the streaming loader and from a snapshot"""
+	tmp_dir = tempfile.mkdtemp()
+	try:
+		snapshot = compile_cty(filename, os.path.join(tmp_dir, "cty.bin"))
+		return([
+			("plistlib", load_cost(_read_plist_tree, filename)),
+			("streaming", load_cost(read_country_file, filename)),
+			("snapshot", load_cost(load_snapshot, snapshot)),
+		])
+	finally:
+		shutil.rmtree(tmp_dir)
+
+def run(number=2000, station_cache=False):
+	"""decode all fixtures; the station cache is disabled by default so that every call gets decoded"""
+	maxsize = Station.cache.maxsize
+	if not station_cache:
+		Station.cache.clear()
+		Station.cache.maxsize = 0
+	try:
+		results = [
+			("Station", cost_per_line(Station, STATION_CALLS, number)),
+			("Spot", cost_per_line(Spot, fixtures("fixture_spot"), number)),
+			("WWV", cost_per_line(WWV, fixtures("fixture_wwv"), number)),
+			("Comment", cost_per_line(Comment, fixtures("fixture_comment"), number)),
+		]
+	finally:
+		Station.cache.maxsize = maxsize
+	return(results)
+
+#------------------Benchmark Suite --------------------
+def corpus(number=CORPUS_LINES, seed=CORPUS_SEED):
+	""" Synthetic, reproducible corpus which resembles a recorded cluster feed: about 90% "DX de"
+	lines (some of them with locators, portable calls or a broken layout), 4% WWV / WCY and
+	6% "To ALL de" lines. The calls are made up from the prefixes of the Country File"""
+	rng = random.Random(seed)
+	spots = spot_lines(number, seed=seed)
+	comments = ["CQ TEST 599", "TNX QSO 73", "JN48QT<ES>IM98", "up 2", "CW 24 WPM", "FT8 -12dB", "", "QSL VIA LOTW", "jo62qm<TR>jo70"]
+	lines = []
+	for i, spot in enumerate(spots):
+		kind = rng.random()
+		if kind < 0.04:
+			if rng.random() < 0.5:
+				lines.append("WWV de VE7CC <%02d>:   SFI=%d, A=%d, K=%d, No Storms -> No Storms" % (rng.randint(0, 23), rng.randint(60, 250), rng.randint(0, 50), rng.randint(0, 9)))
+			else:
+				lines.append("WCY de DK0WCY-1 <%02d> : K=%d expK=%d A=%d R=%d SFI=%d SA=eru GMF=min Au=no" % (rng.randint(0, 23), rng.randint(0, 9), rng.randint(0, 9), rng.randint(0, 50), rng.randint(0, 200), rng.randint(60, 250)))
+		elif kind < 0.10:
+			lines.append("To ALL de %s: %s" % (spot[6:15].split(":")[0], rng.choice(["pse QSY", "tnx for the spot", "anyone hear 6m ES?", "QRV 2m EME tonight"])))
+		else:
+			spot = spot[:39] + "%-30s" % rng.choice(comments) + spot[69:]
+			if kind < 0.30:
+				spot += " " + rng.choice(["JO70", "JN48", "FN42", "IO91", "PM95"])
+			elif kind < 0.31:
+				spot = spot.replace(":", " ", 1) #no colon after the spotter
+			lines.append(spot)
+	return(lines)
+
+def read_corpus(filename):
+	"""the lines of a recorded cluster log"""
+	with open(filename, "rb") as f:
+		return([line.decode("ascii", "replace").rstrip("\r\n") for line in f])
+
+def percentile(values, fraction):
+	"""value below which fraction of the sorted values lie"""
+	return(values[min(len(values) - 1, int(len(values) * fraction))])
+
+def _peak_rss():
+	"""peak resident set size of this process in KB (None if unknown)"""
+	if resource is None:
+		return(None)
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return(peak // 1024 if sys.platform == "darwin" else peak) #bytes on macOS, KB on Linux
+
+def measure(decode, items):
+	""" lines per second (best of REPEAT runs), p50 / p99 latency (microseconds), allocated blocks per line which are
+	still alive after the decode, and peak traced bytes per line of decode(item) for all items"""
+	seconds = None
+	for repeat in range(REPEAT): #the best run, the others suffered from noise
+		Station.cache.clear()
+		gc.collect()
+		start = timeit.default_timer()
+		for item in items:
+			decode(item)
+		elapsed = timeit.default_timer() - start
+		seconds = elapsed if seconds is None else min(seconds, elapsed)
+	Station.cache.clear()
+	timer = timeit.default_timer
+	latencies = []
+	for item in items[:LATENCY_SAMPLE]:
+		start = timer()
+		decode(item)
+		latencies.append(timer() - start)
+	latencies.sort()
+	result = {
+		"lines": len(items),
+		"lines_per_second": len(items) / seconds,
+		"p50_us": percentile(latencies, 0.5) * 1e6,
+		"p99_us": percentile(latencies, 0.99) * 1e6,
+	}
+	if hasattr(sys, "getallocatedblocks"): #Python 3.4+
+		Station.cache.clear()
+		gc.collect()
+		blocks = sys.getallocatedblocks()
+		kept = [decode(item) for item in items]
+		result["blocks_per_line"] = float(sys.getallocatedblocks() - blocks) / len(items)
+		del kept
+	if tracemalloc is not None:
+		Station.cache.clear()
+		gc.collect()
+		tracemalloc.start()
+		kept = [decode(item) for item in items]
+		result["peak_bytes_per_line"] = float(tracemalloc.get_traced_memory()[1]) / len(items)
+		tracemalloc.stop()
+		del kept
+	return(result)
+
+def _load_cty(filename):
+	return(load_cty(filename))
+
+def suite_benchmarks(lines):
+	"""name -> (decode function, items) of the suite"""
+	spots = [line for line in lines if line[:3].upper() == "DX "]
+	calls = []
+	for line in spots:
+		calls.append(line[26:38].strip())
+		calls.append(line[6:15].split(":")[0].strip())
+	cty_file = "cty.plist"
+	return([
+		("Spot", (Spot, spots)),
+		("Station", (Station, calls)),
+		("WWV", (WWV, [line for line in lines if line[:3].upper() in ("WWV", "WCY")])),
+		("Comment", (Comment, [line for line in lines if line[:3].upper() == "TO "])),
+		("parse_line", (parse_line, lines)),
+		("cty_load", (_load_cty, [cty_file] * 3)),
+	])
+
+def _run_isolated(name, decode, items, queue):
+	result = measure(decode, items)
+	result["peak_rss_kb"] = _peak_rss()
+	queue.put((name, result))
+
+def run_suite(lines, isolate=True):
+	""" Run the benchmarks of the suite; every benchmark runs in a process of its own
+	(isolate) so that the peak RSS belongs to that benchmark only"""
+	results = {}
+	for name, (decode, items) in suite_benchmarks(lines):
+		if not items:
+			continue
+		if isolate and hasattr(os, "fork"):
+			queue = multiprocessing.Queue()
+			process = multiprocessing.Process(target=_run_isolated, args=(name, decode, items, queue))
+			process.start()
+			name, result = queue.get()
+			process.join()
+		else:
+			result = measure(decode, items)
+			result["peak_rss_kb"] = _peak_rss()
+		results[name] = result
+	return(results)
+
+def _git_commit():
+	try:
+		return(subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+			stderr=subprocess.STDOUT).decode("ascii").strip())
+	except (OSError, subprocess.CalledProcessError):
+		return(None)
+
+def suite_report(results, corpus_name):
+	"""results with the details of the environment, as written to the JSON file"""
+	return({
+		"commit": _git_commit(),
+		"time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+		"python": platform.python_version(),
+		"implementation": platform.python_implementation(),
+		"platform": platform.platform(),
+		"corpus": corpus_name,
+		"results": results,
+	})
+
+METRICS = ( #metric, True if larger values are better
+	("lines_per_second", True),
+	("p50_us", False),
+	("p99_us", False),
+	("blocks_per_line", False),
+	("peak_bytes_per_line", False),
+	("peak_rss_kb", False),
+)
+
+def compare(before, after, threshold=REGRESSION):
+	""" Changes between two reports of the suite as (benchmark, metric, before, after, change,
+	regression) tuples; change is relative, regression is True if the metric got worse by
+	more than threshold"""
+	changes = []
+	for name in sorted(set(before["results"]) & set(after["results"])):
+		for metric, larger_is_better in METRICS:
+			old = before["results"][name].get(metric)
+			new = after["results"][name].get(metric)
+			if old is None or new is None:
+				continue
+			change = (new - old) / float(old) if old else 0.0
+			worse = -change if larger_is_better else change
+			changes.append((name, metric, old, new, change, worse > threshold))
+	return(changes)
+
+def print_results(results):
+	print("%-11s %12s %9s %9s %8s %11s %10s" % ("benchmark", "lines/s", "p50 us", "p99 us", "blocks", "peak bytes", "RSS KB"))
+	for name, result in sorted(results.items()):
+		print("%-11s %12.0f %9.2f %9.2f %8s %11s %10s" % (name, result["lines_per_second"], result["p50_us"], result["p99_us"],
+			"%.1f" % result["blocks_per_line"] if "blocks_per_line" in result else "-",
+			"%.0f" % result["peak_bytes_per_line"] if "peak_bytes_per_line" in result else "-",
+			result["peak_rss_kb"] if result.get("peak_rss_kb") is not None else "-"))
+
+def micro():
+	"""the former output: cost per fixture line, memory per spot, Spot throughput and cty loaders"""
+	for station_cache in (False, True):
+		print("station cache " + ("enabled" if station_cache else "disabled"))
+		for name, cost in run(station_cache=station_cache):
+			print("  %-8s %8.2f us/line" % (name, cost))
+	memory = memory_per_spot()
+	if memory is not None:
+		print("memory per retained Spot: %.0f bytes" % memory)
+	print("Spot throughput")
+	for name, lines_per_second in spot_throughput():
+		print("  %-10s %8.0f lines/s" % (name, lines_per_second))
+	print("loading cty.plist")
+	for name, (seconds, peak, retained) in cty_loaders():
+		if peak is None:
+			print("  %-10s %7.0f ms" % (name, seconds * 1000))
+		else:
+			print("  %-10s %7.0f ms  peak %6.1f MB  retained %5.1f MB" % (name, seconds * 1000, peak / 1e6, retained / 1e6))
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description="Benchmarks for spot_processing")
+	parser.add_argument("--corpus", help="recorded cluster log instead of the synthetic corpus")
+	parser.add_argument("--lines", type=int, default=CORPUS_LINES, help="lines of the synthetic corpus")
+	parser.add_argument("--json", help="write the results to this file")
+	parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+	parser.add_argument("--threshold", type=float, default=REGRESSION, help="relative change reported as regression by --compare")
+	parser.add_argument("--micro", action="store_true", help="micro benchmarks on the fixtures of testing.py")
+	args = parser.parse_args(argv)
+	if args.compare:
+		with open(args.compare[0]) as f:
+			before = json.load(f)
+		with open(args.compare[1]) as f:
+			after = json.load(f)
+		regressions = 0
+		for name, metric, old, new, change, regression in compare(before, after, args.threshold):
+			regressions += regression
+			print("%-11s %-20s %12.2f %12.2f %+7.1f%%%s" % (name, metric, old, new, change * 100, "  REGRESSION" if regression else ""))
+		return(1 if regressions else 0)
+	if args.micro:
+		micro()
+		return(0)
+	if args.corpus:
+		lines, corpus_name = read_corpus(args.corpus), os.path.basename(args.corpus)
+	else:
+		lines, corpus_name = corpus(args.lines), "synthetic:%d:%d" % (args.lines, CORPUS_SEED)
+	results = run_suite(lines)
+	print_results(results)
+	if args.json:
+		with open(args.json, "w") as f:
+			json.dump(suite_report(results, corpus_name), f, indent=2, sort_keys=True)
+	return(0)
+
+if __name__ == "__main__":
+	sys.exit(main())
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+# Filename: bulk.py
+
+# Decode archived DX-Cluster logs on all CPU cores. The input file is split into shards on
+# line boundaries, the shards are decoded in a pool of worker processes and the decoded spots
+# are written in their original order as tab separated values.
+
+# Execute from command line: "python bulk.py cluster.log spots.tsv [workers]"
+
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from spot_processing import Station, Spot, parse_line
+
+#------------------CONSTANTS --------------------
+SHARD_SIZE = 4 * 1024 * 1024 #bytes
+SPOT_COLUMNS = ("time", "frequency", "band", "mode", "dx_call", "dx_prefix", "dx_country", "dx_continent", "dx_cqz", "dx_ituz",
+	"spotter_call", "spotter_prefix", "spotter_country", "spotter_continent", "comment", "locator")
+
+def shard_offsets(filename, shard_size=SHARD_SIZE):
+	"""split a file into (start, end) byte ranges of about shard_size bytes which begin and end on line boundaries"""
+	size = os.path.getsize(filename)
+	shards = []
+	start = 0
+	with open(filename, "rb") as f:
+		while start < size:
+			f.seek(start + shard_size)
+			f.readline() #move on to the beginning of the next line
+			end = min(f.tell(), size)
+			if end <= start: #shard_size points beyond the end of the file
+				end = size
+			shards.append((start, end))
+			start = end
+	return(shards)
+
+def format_spot(spot):
+	"""one line of tab separated values (see SPOT_COLUMNS) for a Spot"""
+	dx = spot.dx_station
+	spotter = spot.spotter_station
+	fields = (spot.time.strftime("%Y-%m-%dT%H:%MZ"), spot.frequency, spot.band, spot.mode,
+		dx.call, dx.prefix, dx.country, dx.continent, dx.cqz, dx.ituz,
+		spotter.call, spotter.prefix, spotter.country, spotter.continent,
+		spot.comment.replace("\t", " ").strip(), spot.locator)
+	return("\t".join(str(field) for field in fields) + "\n")
+
+def decode_shard(filename, start, end):
+	"""decode the lines within a byte range of a file; returns the formatted spots and counters"""
+	with open(filename, "rb") as f:
+		f.seek(start)
+		data = f.read(end - start)
+	counters = {"lines": 0, "spots": 0, "invalid": 0, "skipped": 0}
+	rows = []
+	for line in data.split(b"\n"): #parse_line takes bytes; only lines of a known type are decoded to str
+		if not line:
+			continue
+		counters["lines"] += 1
+		record = parse_line(line)
+		if not isinstance(record, Spot):
+			counters["skipped"] += 1
+		elif not record.valid:
+			counters["invalid"] += 1
+		else:
+			counters["spots"] += 1
+			rows.append(format_spot(record))
+	return("".join(rows), counters)
+
+def _decode_shard(args):
+	return(decode_shard(*args))
+
+def _init_worker(cty_file):
+	"""runs once in every worker process; the Country File is loaded here and not for every shard"""
+	if cty_file:
+		Station.reload_cty(cty_file)
+
+def decode_file(input_file, output_file, workers=None, shard_size=SHARD_SIZE, cty_file=None):
+	""" Decode all spots of input_file in a pool of worker processes and write them (in their
+	original order) to output_file. Returns counters of the processed lines"""
+	shards = shard_offsets(input_file, shard_size)
+	workers = workers or os.cpu_count() or 1
+	totals = {"lines": 0, "spots": 0, "invalid": 0, "skipped": 0, "shards": len(shards)}
+	with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(cty_file,)) as executor:
+		with open(output_file, "w") as out:
+			out.write("\t".join(SPOT_COLUMNS) + "\n")
+			pending = deque()
+			shards = iter(shards)
+			while True:
+				while len(pending) < 4 * workers: #bounds the decoded shards kept in memory
+					shard = next(shards, None)
+					if shard is None:
+						break
+					pending.append(executor.submit(_decode_shard, (input_file,) + shard))
+				if not pending:
+					break
+				rows, counters = pending.popleft().result()
+				out.write(rows)
+				for key in counters:
+					totals[key] += counters[key]
+	return(totals)
+
+
+if __name__ == "__main__":
+	if len(sys.argv) < 3:
+		print("usage: python bulk.py cluster.log spots.tsv [workers]")
+		sys.exit(1)
+	workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+	print(decode_file(sys.argv[1], sys.argv[2], workers))
+
+# End of bulk.py
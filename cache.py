@@ -0,0 +1,77 @@
+#!/usr/bin/python
+# Filename: cache.py
+
+from collections import OrderedDict
+
+class LRUCache(object):
+	"""Size bounded cache which evicts the least recently used entry; counts hits, misses and evictions"""
+
+	def __init__(self, maxsize=16384):
+		self.maxsize = maxsize
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._data = OrderedDict()
+		if hasattr(self._data, "move_to_end"):
+			self._touch = self._data.move_to_end
+		else: #Python 2
+			self._touch = self.__reinsert
+
+	def __reinsert(self, key):
+		self._data[key] = self._data.pop(key)
+
+	def __len__(self):
+		return(len(self._data))
+
+	def __contains__(self, key):
+		return(key in self._data)
+
+	def get(self, key, default=None):
+		"""return the cached value and mark it as recently used"""
+		try:
+			value = self._data[key]
+			self._touch(key)
+		except KeyError: #also raised if the cache got cleared in between
+			self.misses += 1
+			return(default)
+		self.hits += 1
+		return(value)
+
+	def put(self, key, value):
+		"""store a value; evicts the least recently used entry when the cache is full"""
+		self._data[key] = value
+		self._touch(key)
+		while len(self._data) > self.maxsize:
+			try:
+				self._data.popitem(last=False)
+			except KeyError:
+				break
+			self.evictions += 1
+
+	def pop(self, key, default=None):
+		"""remove a single entry"""
+		return(self._data.pop(key, default))
+
+	def keys(self):
+		"""snapshot of the cached keys, least recently used first"""
+		return(list(self._data.keys()))
+
+	def items(self):
+		"""snapshot of the cached (key, value) pairs, least recently used first"""
+		return(list(self._data.items()))
+
+	def clear(self):
+		"""drop all entries; the counters are kept"""
+		self._data.clear()
+
+	def stats(self):
+		"""counters as a dict"""
+		return({
+			'size': len(self._data),
+			'maxsize': self.maxsize,
+			'hits': self.hits,
+			'misses': self.misses,
+			'evictions': self.evictions
+		})
+
+# End of cache.py
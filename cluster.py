@@ -0,0 +1,194 @@
+#!/usr/bin/python
+# Filename: cluster.py
+
+# Connection to a DX Cluster (telnet) based on asyncio; requires Python 3.5 or newer.
+# The received lines are decoded by spot_processing.parse_line into Spot, WWV and Comment objects.
+
+import re
+import random
+import asyncio
+import logging
+from spot_processing import parse_line, root_logger
+
+#------------------CONSTANTS --------------------
+LOGIN_PROMPTS = (b"login:", b"call:", b"callsign:", b"please enter your call")
+PASSWORD_PROMPTS = (b"password:",)
+MAX_LINE_LENGTH = 4096 #longer lines are discarded
+RE_TELNET_COMMAND = re.compile(b"\xff[\xfb-\xfe].|\xff[\xf0-\xfa]", re.S) #IAC WILL/WONT/DO/DONT <option> and IAC <command>
+
+logger = logging.getLogger(root_logger)
+
+_CLOSED = object() #put into the queue when the connection has been closed
+
+class ClusterConnection(object):
+	""" Connection to a DX Cluster which logs in, reconnects with exponential backoff and puts
+	the decoded Spot, WWV and Comment objects into an asyncio queue. Use it as async iterator:
+
+	async with ClusterConnection("dxc.example.com", 7300, "DH1TW") as cluster:
+		async for record in cluster:
+			...
+
+	Several connections can share one queue (queue=...) to merge the feeds of many clusters.
+	When the queue is full the connection stops reading from its socket (backpressure)."""
+
+	def __init__(self, host, port, login, password=None, queue=None, queue_size=1000, skip_invalid=False,
+		min_backoff=1.0, max_backoff=300.0, read_timeout=None, name=None):
+		self.host = host
+		self.port = port
+		self.login = login
+		self.password = password
+		self.name = name or "%s:%s" % (host, port)
+		self.skip_invalid = skip_invalid
+		self.min_backoff = min_backoff
+		self.max_backoff = max_backoff
+		self.read_timeout = read_timeout
+		self._own_queue = queue is None
+		self.queue = asyncio.Queue(queue_size) if queue is None else queue
+		self.connected = False
+		self.connects = 0
+		self.lines = 0
+		self.records = 0
+		self._closed = False
+		self._stop = asyncio.Event()
+		self._writer = None
+		self._task = None
+
+	#------------------Public Methods --------------------
+	async def run(self):
+		"""connect, read and decode until close() is called; reconnects whenever the connection drops"""
+		try:
+			await self._connect_loop()
+		except asyncio.CancelledError:
+			if self._own_queue and not self.queue.full():
+				self.queue.put_nowait(_CLOSED)
+			raise
+		if self._own_queue:
+			await self.queue.put(_CLOSED)
+
+	def start(self):
+		"""run the connection as a task of the running event loop"""
+		if self._task is None:
+			self._task = asyncio.ensure_future(self.run())
+		return(self._task)
+
+	def close(self):
+		"""stop the connection; the async iterator ends after the remaining records"""
+		self._closed = True
+		self._stop.set()
+		if self._writer is not None:
+			self._writer.close()
+
+	async def send(self, command):
+		"""send a command (e.g. "sh/dx 10") to the cluster"""
+		if self._writer is None:
+			raise Exception(self.name + ": not connected")
+		self._writer.write(command.encode("ascii") + b"\r\n")
+		await self._writer.drain()
+
+	#------------------Async Iterator --------------------
+	def __aiter__(self):
+		return(self)
+
+	async def __anext__(self):
+		record = await self.queue.get()
+		if record is _CLOSED:
+			raise StopAsyncIteration
+		return(record)
+
+	async def __aenter__(self):
+		self.start()
+		return(self)
+
+	async def __aexit__(self, exc_type, exc, tb):
+		self.close()
+		if self._task is not None:
+			self._task.cancel()
+			try:
+				await self._task
+			except asyncio.CancelledError:
+				pass
+
+	#------------------Internal Methods --------------------
+	async def _connect_loop(self):
+		backoff = self.min_backoff
+		while not self._closed:
+			try:
+				reader, writer = await asyncio.open_connection(self.host, self.port)
+			except OSError as e:
+				logger.warning("%s: connect failed: %s", self.name, e)
+			else:
+				self.connects += 1
+				if await self._session(reader, writer):
+					backoff = self.min_backoff #session was alive - start over with a short delay
+			if self._closed:
+				break
+			delay = backoff * (1.0 + 0.1 * random.random()) #jitter, so that many connections don't reconnect in lockstep
+			logger.info("%s: reconnecting in %.1fs", self.name, delay)
+			try:
+				await asyncio.wait_for(self._stop.wait(), delay)
+			except asyncio.TimeoutError:
+				pass
+			backoff = min(backoff * 2, self.max_backoff)
+
+	async def _session(self, reader, writer):
+		"""read from one connection until it drops; returns True if anything has been received"""
+		self._writer = writer
+		self.connected = True
+		received = False
+		logged_in = False
+		buf = bytearray()
+		try:
+			while not self._closed:
+				if self.read_timeout:
+					data = await asyncio.wait_for(reader.read(65536), self.read_timeout)
+				else:
+					data = await reader.read(65536)
+				if not data:
+					logger.warning("%s: connection closed by the cluster", self.name)
+					break
+				received = True
+				buf += data
+				if b"\xff" in buf: #also sequences split across reads; an incomplete one stays in buf until the rest arrives
+					buf = bytearray(RE_TELNET_COMMAND.sub(b"", buf))
+
+				start = 0
+				while True:
+					end = buf.find(b"\n", start)
+					if end < 0:
+						break
+					await self._line(bytes(buf[start:end]))
+					start = end + 1
+				del buf[:start]
+
+				if not logged_in and buf:
+					prompt = bytes(buf).strip().lower()
+					if prompt.endswith(LOGIN_PROMPTS):
+						writer.write(self.login.encode("ascii") + b"\r\n")
+						logged_in = True
+						del buf[:]
+				if self.password and buf and bytes(buf).strip().lower().endswith(PASSWORD_PROMPTS):
+					writer.write(self.password.encode("ascii") + b"\r\n")
+					del buf[:]
+				if len(buf) > MAX_LINE_LENGTH:
+					del buf[:]
+		except (OSError, asyncio.TimeoutError) as e:
+			logger.warning("%s: connection lost: %s", self.name, e)
+		finally:
+			self.connected = False
+			self._writer = None
+			writer.close()
+		return(received)
+
+	async def _line(self, line):
+		"""decode one line and queue the result"""
+		self.lines += 1
+		line = line.rstrip(b"\r\x07")
+		if not line:
+			return
+		record = parse_line(line) #takes bytes; only lines of a known type are decoded to str
+		if record is None or (self.skip_invalid and not record.valid):
+			return
+		self.records += 1
+		await self.queue.put(record) #blocks while the queue is full
+
+# End of cluster.py
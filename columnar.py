@@ -0,0 +1,258 @@
+#!/usr/bin/python
+# Filename: columnar.py
+
+# Decode whole archives of DX-Cluster logs into columns (NumPy arrays or an Arrow table) for
+# analytics. The "DX de" lines are checked and split with array operations on a byte matrix
+# (one row per line) and every distinct callsign is looked up only once, so no Spot object is
+# built for a line in the standard column layout. NumPy is required; pyarrow only for to_arrow().
+
+# Execute from command line: "python columnar.py cluster.log [spots.parquet]"
+
+import sys
+import numpy
+from spot_processing import Station, Spot
+from timestamps import TimestampResolver, MINUTES_PER_DAY
+from geo import great_circle_array
+
+#------------------CONSTANTS --------------------
+BATCH_SIZE = 1000000 #lines which are decoded at once; bounds the size of the byte matrix
+LINE_WIDTH = 80 #columns of the standard "DX de" layout; longer lines are cut
+CONTINENTS = ("", "AF", "AN", "AS", "EU", "NA", "OC", "SA") #continent codes of the columns; 0 = unknown
+COLUMNS = ("time", "frequency", "band", "mode", "dx_call", "dx_entity", "dx_cqz", "dx_ituz", "dx_continent",
+	"spotter_call", "spotter_entity", "spotter_cqz", "spotter_ituz", "spotter_continent", "valid")
+
+def _char_table(chars):
+	"""boolean lookup table which maps a byte to True if it is one of chars"""
+	table = numpy.zeros(256, dtype=bool)
+	table[numpy.frombuffer(chars, dtype=numpy.uint8)] = True
+	return(table)
+
+_CALL_CHARS = _char_table(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789/")
+_FREQUENCY_CHARS = _char_table(b"0123456789.")
+_DIGITS = _char_table(b"0123456789")
+_SPACE = ord(" ")
+
+
+class SpotColumns(object):
+	""" Decoded spots as columns of equal length (see COLUMNS), in the order of the lines.
+	Callsigns are stored once in self.calls; dx_call and spotter_call are indexes into it.
+	mode and *_continent are codes into self.modes and self.continents, *_entity are the
+	ids of the DXCC entities (tables.entities) and -1 if a call couldn't be resolved"""
+
+	def __init__(self, columns, calls, modes, continents, tables, skipped=0, positions=None):
+		self.columns = columns
+		self.calls = calls
+		self.modes = modes
+		self.continents = continents
+		self.tables = tables #version of the Country File which has been used
+		self.skipped = skipped #"DX de" lines which couldn't be decoded at all
+		self.positions = positions #(latitudes, longitudes positive East) per call, NaN if unknown
+
+	def __len__(self):
+		return(len(self.columns["frequency"]))
+
+	def __getitem__(self, name):
+		return(self.columns[name])
+
+	def paths(self):
+		""" Great circle distance (km) and bearing (degrees) from the spotter to the DX station of
+		every spot as two arrays, computed from the positions of the Country File; NaN if a
+		call couldn't be resolved"""
+		latitude, longitude = self.positions
+		dx = self.columns["dx_call"]
+		spotter = self.columns["spotter_call"]
+		return(great_circle_array(latitude[spotter], longitude[spotter], latitude[dx], longitude[dx]))
+
+	def to_arrow(self):
+		""" pyarrow.Table of the columns; calls, modes and continents become dictionary
+		encoded columns, so that pandas gets categoricals and Parquet dictionary pages"""
+		import pyarrow
+		calls = pyarrow.array(self.calls, type=pyarrow.string())
+		modes = pyarrow.array(list(self.modes), type=pyarrow.string())
+		continents = pyarrow.array(list(self.continents), type=pyarrow.string())
+		dictionaries = {"dx_call": calls, "spotter_call": calls, "mode": modes,
+			"dx_continent": continents, "spotter_continent": continents}
+		arrays = []
+		for name in COLUMNS:
+			column = self.columns[name]
+			if name in dictionaries:
+				arrays.append(pyarrow.DictionaryArray.from_arrays(pyarrow.array(column), dictionaries[name]))
+			elif name == "time":
+				arrays.append(pyarrow.array(column.astype("datetime64[s]")))
+			else:
+				arrays.append(pyarrow.array(column))
+		return(pyarrow.Table.from_arrays(arrays, names=list(COLUMNS)))
+
+
+def _contiguous(field):
+	""" rows of a byte matrix whose non-blank characters are not interrupted by blanks (like
+	the fields which split_spot strips); returns the check and the number of non-blank characters"""
+	filled = field != _SPACE
+	count = filled.sum(axis=1)
+	first = filled.argmax(axis=1)
+	last = field.shape[1] - filled[:, ::-1].argmax(axis=1)
+	return((count == 0) | (last - first == count), count)
+
+def _split_matrix(matrix):
+	""" Vectorized split_spot for a byte matrix of "DX de" lines. Returns the rows which follow
+	the standard layout and their frequency, minute of the day, dx call and spotter call;
+	the calls are fixed width byte strings which still contain the blanks of the line"""
+	cols = numpy.arange(LINE_WIDTH)
+	is_colon = matrix[:, 6:15] == ord(":")
+	colon = is_colon.argmax(axis=1) + 6
+	ok = is_colon.any(axis=1) & (colon >= 7)
+	ok &= (_CALL_CHARS[matrix[:, 6:15]] | (cols[6:15] >= colon[:, None])).all(axis=1)
+
+	start = numpy.maximum(colon + 1, 10)
+	frequency = numpy.where(cols[10:25] >= start[:, None], matrix[:, 10:25], _SPACE).astype(numpy.uint8)
+	contiguous, length = _contiguous(frequency)
+	ok &= contiguous & (length >= 5) & (length <= 12)
+	ok &= (_FREQUENCY_CHARS[frequency] | (frequency == _SPACE)).all(axis=1)
+	ok &= (frequency == ord(".")).sum(axis=1) <= 1
+
+	time = matrix[:, 70:74].astype(numpy.int16)
+	ok &= _DIGITS[matrix[:, 70:74]].all(axis=1)
+	hour = (time[:, 0] - 48) * 10 + time[:, 1] - 48
+	minute = (time[:, 2] - 48) * 10 + time[:, 3] - 48
+	ok &= (hour <= 23) & (minute <= 59)
+
+	dx_call = matrix[:, 26:38]
+	contiguous, length = _contiguous(dx_call)
+	ok &= contiguous & (_CALL_CHARS[dx_call] | (dx_call == _SPACE)).all(axis=1)
+
+	rows = numpy.flatnonzero(ok)
+	frequency = numpy.ascontiguousarray(frequency[rows]).view("S15").ravel().astype(float)
+	spotter_call = numpy.where(cols[6:15] < colon[rows, None], matrix[rows, 6:15], 0).astype(numpy.uint8)
+	return(rows, frequency, hour[rows] * 60 + minute[rows],
+		numpy.ascontiguousarray(dx_call[rows]).view("S12").ravel(),
+		numpy.ascontiguousarray(spotter_call).view("S9").ravel().astype("S12"))
+
+def _decode_batch(lines):
+	""" (frequency, minute of the day, dx call, spotter call) arrays of the spots of a list of
+	byte strings. Lines which don't follow the standard layout are decoded by Spot"""
+	lines = [line for line in lines if line[:3].upper() == b"DX "]
+	if not lines:
+		return(None, 0)
+	matrix = numpy.array(lines, dtype="S%d" % LINE_WIDTH).view(numpy.uint8).reshape(-1, LINE_WIDTH)
+	rows, frequency, minute, dx_call, spotter_call = _split_matrix(matrix)
+	others = numpy.ones(len(lines), dtype=bool)
+	others[rows] = False
+	fallback = []
+	for row in numpy.flatnonzero(others):
+		spot = Spot(lines[row].rstrip(b"\r\n"))
+		if spot.dx_station is not None: #the line has been decoded, maybe with invalid stations
+			fallback.append((row, spot.frequency, spot.time.hour * 60 + spot.time.minute,
+				spot.dx_call.encode("ascii"), spot.spotter_call.encode("ascii")))
+	skipped = int(others.sum()) - len(fallback)
+	if fallback:
+		row, freq, minutes, dx_calls, spotter_calls = zip(*fallback)
+		order = numpy.argsort(numpy.concatenate([rows, row]), kind="mergesort")
+		frequency = numpy.concatenate([frequency, freq])[order]
+		minute = numpy.concatenate([minute, minutes])[order]
+		dx_call = numpy.concatenate([dx_call, numpy.array(dx_calls, dtype="S12")])[order]
+		spotter_call = numpy.concatenate([spotter_call, numpy.array(spotter_calls, dtype="S12")])[order]
+	return((frequency, minute, dx_call, spotter_call), skipped)
+
+def _resolve_calls(raw_calls, tables):
+	""" Intern the distinct calls and look each of them up once. Returns the codes of raw_calls,
+	the calls and the entity id, CQ zone, ITU zone, continent code and validity per call"""
+	distinct, codes = numpy.unique(raw_calls, return_inverse=True)
+	calls = []
+	index = {}
+	remap = numpy.empty(len(distinct), dtype=numpy.int32)
+	for i, raw in enumerate(distinct):
+		call = raw.decode("ascii").strip(" ")
+		code = index.get(call)
+		if code is None:
+			code = index[call] = len(calls)
+			calls.append(sys.intern(call))
+		remap[i] = code
+	continents = list(CONTINENTS)
+	entity = numpy.full(len(calls), -1, dtype=numpy.int16)
+	cqz = numpy.zeros(len(calls), dtype=numpy.int8)
+	ituz = numpy.zeros(len(calls), dtype=numpy.int8)
+	continent = numpy.zeros(len(calls), dtype=numpy.int8)
+	valid = numpy.zeros(len(calls), dtype=bool)
+	latitude = numpy.full(len(calls), numpy.nan)
+	longitude = numpy.full(len(calls), numpy.nan)
+	for code, call in enumerate(calls):
+		station = Station(call)
+		if not station.valid:
+			continue
+		valid[code] = True
+		latitude[code] = station.latitude
+		longitude[code] = -station.longitude #the Country File counts longitudes positive to the West
+		entity[code] = tables.entity_ids.get(station.prefix, -1)
+		cqz[code] = station.cqz
+		ituz[code] = station.ituz
+		if station.continent not in continents:
+			continents.append(station.continent)
+		continent[code] = continents.index(station.continent)
+	return(remap[codes.ravel()], numpy.array(calls, dtype=object), (entity, cqz, ituz, continent, valid, latitude, longitude), tuple(continents))
+
+def _build_columns(parts, skipped, date):
+	tables = Station.database.tables
+	if parts:
+		frequency, minute, dx_call, spotter_call = [numpy.concatenate(column) for column in zip(*parts)]
+	else:
+		frequency, minute = numpy.zeros(0), numpy.zeros(0, dtype=numpy.int16)
+		dx_call = spotter_call = numpy.zeros(0, dtype="S12")
+	codes, calls, per_call, continents = _resolve_calls(numpy.concatenate([dx_call, spotter_call]), tables)
+	dx_codes, spotter_codes = codes[:len(dx_call)], codes[len(dx_call):]
+	entity, cqz, ituz, continent, valid, latitude, longitude = per_call
+	bands, modes = Spot.band_plan.lookup_array(frequency)
+	days = numpy.array(TimestampResolver(date=date).days(minute.tolist()), dtype=numpy.int64)
+	columns = {
+		"time": (days * MINUTES_PER_DAY + minute).astype("datetime64[m]"),
+		"frequency": frequency,
+		"band": bands,
+		"mode": modes,
+		"dx_call": dx_codes,
+		"dx_entity": entity[dx_codes],
+		"dx_cqz": cqz[dx_codes],
+		"dx_ituz": ituz[dx_codes],
+		"dx_continent": continent[dx_codes],
+		"spotter_call": spotter_codes,
+		"spotter_entity": entity[spotter_codes],
+		"spotter_cqz": cqz[spotter_codes],
+		"spotter_ituz": ituz[spotter_codes],
+		"spotter_continent": continent[spotter_codes],
+		"valid": valid[dx_codes] & valid[spotter_codes],
+	}
+	return(SpotColumns(columns, calls, tuple(Spot.band_plan.modes), continents, tables, skipped, (latitude, longitude)))
+
+def decode_lines(lines, date=None, batch_size=BATCH_SIZE):
+	""" Decode an iterable of lines (str or bytes) into SpotColumns; lines which aren't spots
+	are skipped. The times of the spots are dated by a TimestampResolver: from date on, with a
+	new day whenever the time rolls over midnight, or relative to the current time without date"""
+	parts = []
+	skipped = 0
+	batch = []
+	for line in lines:
+		batch.append(line if isinstance(line, bytes) else line.encode("ascii", "replace"))
+		if len(batch) >= batch_size:
+			part, count = _decode_batch(batch)
+			parts += [part] if part else []
+			skipped += count
+			batch = []
+	part, count = _decode_batch(batch)
+	parts += [part] if part else []
+	return(_build_columns(parts, skipped + count, date))
+
+def read_columns(filename, date=None, batch_size=BATCH_SIZE):
+	"""decode all spots of an archived DX-Cluster log into SpotColumns"""
+	with open(filename, "rb") as f:
+		return(decode_lines(f, date, batch_size))
+
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("usage: python columnar.py cluster.log [spots.parquet]")
+		sys.exit(1)
+	spots = read_columns(sys.argv[1])
+	print("%d spots, %d distinct calls, %d skipped" % (len(spots), len(spots.calls), spots.skipped))
+	if len(sys.argv) > 2:
+		import pyarrow.parquet
+		pyarrow.parquet.write_table(spots.to_arrow(), sys.argv[2])
+
+# End of columnar.py
@@ -1,13 +1,684 @@
 #!/usr/bin/python
 # Filename: cty.py
 
-def load_cty(filename):
-	""" Load Country Information from plist file (http://www.country-files.com/cty/history.htm)"""
+import os
+import re
+import sys
+import csv
+import mmap
+import struct
+import hashlib
+import threading
+from collections import namedtuple, Counter
+
+#------------------CONSTANTS --------------------
+SNAPSHOT_MAGIC = b"CTYS"
+SNAPSHOT_VERSION = 1
+
+# magic, version, reserved, sha1 of the source plist, number of strings, number of entries
+_SNAPSHOT_HEADER = struct.Struct("<4sHH20sII")
+# prefix, country, continent (string table indices), cqz, ituz, latitude, longitude, gmt offset, exact callsign
+_SNAPSHOT_ENTRY = struct.Struct("<IIIhhdddB")
+
+# alias of cty.dat / cty.csv: "=" for exact callsigns, the call or prefix and its overrides
+RE_ALIAS = re.compile(r'^(=?)([^\(\[<\{~]+)(.*)$')
+RE_CQZ_OVERRIDE = re.compile(r'\((\d+)\)')
+RE_ITUZ_OVERRIDE = re.compile(r'\[(\d+)\]')
+RE_LOCATION_OVERRIDE = re.compile(r'<([\-\d\.]+)/([\-\d\.]+)>')
+RE_CONTINENT_OVERRIDE = re.compile(r'\{([A-Z]{2})\}')
+RE_OFFSET_OVERRIDE = re.compile(r'~([\-\d\.]+)~')
+
+# Country information of a prefix; one record is shared by all stations with this prefix
+CtyInfo = namedtuple("CtyInfo", "country latitude longitude cqz ituz continent offset")
+
+class CtyEntry(namedtuple("CtyEntry", "country cqz ituz continent latitude longitude offset exact")):
+	""" Entry of the Country File as a compact tuple. Fields can also be read with the keys
+	of the plist file (entry['Country'], entry.get('ExactCallsign'))"""
+	__slots__ = ()
+	KEYS = ('Country', 'CQZone', 'ITUZone', 'Continent', 'Latitude', 'Longitude', 'GMTOffset', 'ExactCallsign')
+
+	def __getitem__(self, key):
+		if key.__class__ is str:
+			try:
+				return(tuple.__getitem__(self, CtyEntry._INDEX[key]))
+			except KeyError:
+				raise KeyError(key)
+		return(tuple.__getitem__(self, key))
+
+	def get(self, key, default=None):
+		index = CtyEntry._INDEX.get(key)
+		if index is None:
+			return(default)
+		return(tuple.__getitem__(self, index))
+
+	def keys(self):
+		return(list(CtyEntry.KEYS))
+
+	def items(self):
+		return(list(zip(CtyEntry.KEYS, self)))
+
+	@classmethod
+	def from_plist(cls, fields):
+		"""entry from a dict with the keys of the plist file; ExactCallsign is optional"""
+		return(cls(fields['Country'], fields['CQZone'], fields['ITUZone'], fields['Continent'],
+			fields['Latitude'], fields['Longitude'], fields['GMTOffset'], fields.get('ExactCallsign', False)))
+
+CtyEntry._INDEX = dict((key, i) for i, key in enumerate(CtyEntry.KEYS))
+
+if bytes is str: #Python 2 - ElementTree returns plain strings as well
+	_decode = lambda raw: raw
+	_encode = lambda text: text
+	_intern = lambda text: intern(text) if isinstance(text, str) else text
+else:
+	_decode = lambda raw: raw.decode("utf-8")
+	_encode = lambda text: text.encode("utf-8")
+	_intern = sys.intern
+
+
+def load_cty(filename, snapshot=None):
+	""" Load Country Information from plist file (http://www.country-files.com/cty/history.htm)
+	into a dict of CtyEntry by prefix. A compiled snapshot (see compile_cty) is used instead if
+	it matches the plist file"""
+	if snapshot is None:
+		snapshot = snapshot_filename(filename)
+	try:
+		if os.path.isfile(snapshot):
+			checksum = None
+			if os.path.isfile(filename):
+				checksum = plist_checksum(filename)
+			country_list = load_snapshot(snapshot, checksum)
+			if country_list:
+				return(country_list)
+	except Exception:
+		pass #snapshot is broken - fall back to the plist file
+	try:
+		return(read_country_file(filename))
+	except Exception:
+		return(False)
+
+def read_country_file(filename):
+	"""parse a Country File in plist, cty.dat or cty.csv format (chosen by the file extension)"""
+	return(_shared_entries(iter_country_file(filename)))
+
+def _shared_entries(items):
+	"""dict of the (prefix, CtyEntry) pairs; equal entries (most prefixes of a country) share one tuple"""
+	country_list = {}
+	shared = {}
+	for prefix, entry in items:
+		country_list[prefix] = shared.setdefault(entry, entry)
+	return(country_list)
+
+def iter_country_file(filename):
+	""" Generator which reads a Country File in plist, cty.dat or cty.csv format and yields
+	(prefix, CtyEntry) pairs; entries are decoded while the file is read, no parse tree is kept"""
+	extension = os.path.splitext(filename)[1].lower()
+	if extension == ".dat":
+		return(_iter_dat(filename))
+	if extension == ".csv":
+		return(_iter_csv(filename))
+	return(_iter_plist(filename))
+
+def _iter_plist(filename):
+	""" parse the XML plist file incrementally: a top level dict which maps every prefix to a
+	dict of the fields of CtyEntry.KEYS"""
+	try:
+		from xml.etree.cElementTree import iterparse #Python 2
+	except ImportError:
+		from xml.etree.ElementTree import iterparse
+	depth = 0
+	top = None
+	prefix = key = None
+	fields = {}
+	for event, elem in iterparse(filename, events=("start", "end")):
+		tag = elem.tag
+		if event == "start":
+			if tag == "dict":
+				depth += 1
+				if depth == 1:
+					top = elem
+			continue
+		if tag == "dict":
+			depth -= 1
+			if depth == 1: #end of an entry
+				try:
+					yield(_intern(prefix), CtyEntry.from_plist(fields))
+				except KeyError as e:
+					raise ValueError("Entry " + str(prefix) + " in " + filename + " lacks " + str(e))
+				fields = {}
+				top.clear() #drop the parsed elements; memory stays bounded by one entry
+		elif tag == "key":
+			if depth == 1:
+				prefix = elem.text
+			else:
+				key = elem.text
+		elif depth == 2:
+			fields[key] = _PLIST_VALUES[tag](elem.text)
+
+_PLIST_VALUES = {
+	"string": lambda text: _intern(text or ""),
+	"integer": int,
+	"real": float,
+	"true": lambda text: True,
+	"false": lambda text: False
+}
+
+def _iter_dat(filename):
+	""" parse cty.dat line by line: a header line per country (name, CQ zone, ITU zone, continent,
+	latitude, longitude, GMT offset, primary prefix separated by colons) and its aliases,
+	separated by commas and terminated by a semicolon"""
+	with open(filename) as f:
+		entry = None
+		aliases = []
+		for line in f:
+			if entry is None:
+				if not line.strip():
+					continue
+				fields = line.split(":")
+				if len(fields) < 9:
+					raise ValueError("Invalid line in " + filename + ": " + line.strip()[:40])
+				country, cqz, ituz, continent, latitude, longitude, offset = fields[:7]
+				entry = CtyEntry(_intern(country.strip()), int(cqz), int(ituz), _intern(continent.strip()),
+					float(latitude), float(longitude), float(offset), False)
+				continue
+			line = line.strip()
+			end = line.endswith(";")
+			aliases.extend(alias for alias in line.rstrip(";").split(",") if alias.strip())
+			if end:
+				for item in _iter_aliases(aliases, entry):
+					yield(item)
+				entry = None
+				aliases = []
+		if entry is not None:
+			raise ValueError("Missing semicolon after the last record in " + filename)
+
+def _iter_csv(filename):
+	""" parse cty.csv: one line per country (primary prefix, name, DXCC entity number, continent,
+	CQ zone, ITU zone, latitude, longitude, GMT offset, aliases separated by spaces and terminated
+	by a semicolon)"""
+	with open(filename) as f:
+		for row in csv.reader(f):
+			if not row:
+				continue
+			if len(row) != 10:
+				raise ValueError("Invalid line in " + filename + ": " + ",".join(row)[:40])
+			primary_prefix, country, entity, continent, cqz, ituz, latitude, longitude, offset, aliases = row
+			entry = CtyEntry(_intern(country.strip()), int(cqz), int(ituz), _intern(continent.strip()),
+				float(latitude), float(longitude), float(offset), False)
+			for item in _iter_aliases(aliases.rstrip("; ").split(), entry):
+				yield(item)
+
+def _iter_aliases(aliases, entry):
+	"""(prefix, CtyEntry) for each alias of a country with its overrides applied"""
+	for alias in aliases:
+		match = RE_ALIAS.match(alias.strip())
+		if not match:
+			continue
+		exact, key, overrides = match.groups()
+		alias_entry = entry
+		if exact:
+			alias_entry = alias_entry._replace(exact=True)
+		if overrides:
+			changes = {}
+			override = RE_CQZ_OVERRIDE.search(overrides)
+			if override:
+				changes['cqz'] = int(override.group(1))
+			override = RE_ITUZ_OVERRIDE.search(overrides)
+			if override:
+				changes['ituz'] = int(override.group(1))
+			override = RE_LOCATION_OVERRIDE.search(overrides)
+			if override:
+				changes['latitude'] = float(override.group(1))
+				changes['longitude'] = float(override.group(2))
+			override = RE_CONTINENT_OVERRIDE.search(overrides)
+			if override:
+				changes['continent'] = _intern(override.group(1))
+			override = RE_OFFSET_OVERRIDE.search(overrides)
+			if override:
+				changes['offset'] = float(override.group(1))
+			alias_entry = alias_entry._replace(**changes)
+		yield(_intern(key), alias_entry)
+
+def snapshot_filename(filename):
+	"""default location of the compiled snapshot for a plist file (cty.plist -> cty.bin)"""
+	return(os.path.splitext(filename)[0] + ".bin")
+
+def plist_checksum(filename):
+	"""SHA1 digest of the Country File which a snapshot has been compiled from"""
+	digest = hashlib.sha1()
+	with open(filename, "rb") as f:
+		for chunk in iter(lambda: f.read(1 << 16), b""):
+			digest.update(chunk)
+	return(digest.digest())
+
+def compile_cty(filename, snapshot=None):
+	""" Compile the plist file into a binary snapshot which can be loaded within milliseconds"""
+	if snapshot is None:
+		snapshot = snapshot_filename(filename)
+	country_list = read_country_file(filename)
+
+	strings = []
+	string_index = {}
+	def index_of(text):
+		if text not in string_index:
+			string_index[text] = len(strings)
+			strings.append(_encode(text))
+		return(string_index[text])
+
+	entries = []
+	for prefix in sorted(country_list):
+		entry = country_list[prefix]
+		entries.append(_SNAPSHOT_ENTRY.pack(index_of(prefix), index_of(entry.country), index_of(entry.continent),
+			entry.cqz, entry.ituz, entry.latitude, entry.longitude, entry.offset, entry.exact))
+
+	offsets = [0]
+	for text in strings:
+		offsets.append(offsets[-1] + len(text))
+
+	tmp_snapshot = snapshot + ".tmp"
+	with open(tmp_snapshot, "wb") as f:
+		f.write(_SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, plist_checksum(filename), len(strings), len(entries)))
+		f.write(struct.pack("<%dI" % len(offsets), *offsets))
+		f.write(b"".join(strings))
+		f.write(b"".join(entries))
+	os.rename(tmp_snapshot, snapshot) #readers never see a half written snapshot
+	return(snapshot)
+
+def load_snapshot(snapshot, checksum=None):
+	""" Load a snapshot written by compile_cty; returns False if it has an unknown version
+	or was compiled from a plist file with a different checksum"""
+	with open(snapshot, "rb") as f:
+		buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
 	try:
-		import plistlib
-		country_list = plistlib.readPlist(filename)
-		return(country_list)
-	except:
+		magic, version, reserved, digest, nr_strings, nr_entries = _SNAPSHOT_HEADER.unpack_from(buf, 0)
+		if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+			return(False)
+		if checksum is not None and digest != checksum: #snapshot is stale
+			return(False)
+
+		pos = _SNAPSHOT_HEADER.size
+		offsets = struct.unpack_from("<%dI" % (nr_strings + 1), buf, pos)
+		pos += 4 * (nr_strings + 1)
+		strings = [_intern(_decode(buf[pos + offsets[i]:pos + offsets[i + 1]])) for i in range(nr_strings)]
+		pos += offsets[-1]
+
+		unpack_entry = _SNAPSHOT_ENTRY.unpack_from
+		entry_size = _SNAPSHOT_ENTRY.size
+		def entries(pos):
+			for i in range(nr_entries):
+				prefix, country, continent, cqz, ituz, latitude, longitude, offset, exact = unpack_entry(buf, pos)
+				pos += entry_size
+				yield(strings[prefix], CtyEntry(strings[country], cqz, ituz, strings[continent],
+					latitude, longitude, offset, bool(exact)))
+		return(_shared_entries(entries(pos)))
+	finally:
+		buf.close()
+
+def diff_cty(old, new):
+	"""compare two Country Files (as returned by load_cty) entry by entry"""
+	changes = CtyDiff()
+	for prefix, info in new.items():
+		old_info = old.get(prefix)
+		if old_info is None:
+			changes.added[prefix] = info
+		elif old_info != info:
+			changes.changed[prefix] = (old_info, info)
+	for prefix, info in old.items():
+		if prefix not in new:
+			changes.removed[prefix] = info
+	return(changes)
+
+class CtyDiff(object):
+	""" Entries which have been added, removed or changed between two versions of the Country
+	File (see diff_cty) and which of them moved to another country or zone"""
+
+	def __init__(self):
+		self.added = {} #prefix -> entry
+		self.removed = {} #prefix -> entry
+		self.changed = {} #prefix -> (old entry, new entry)
+		self._extended = None
+
+	def __len__(self):
+		return(len(self.added) + len(self.removed) + len(self.changed))
+
+	def __contains__(self, prefix):
+		return(prefix in self.added or prefix in self.removed or prefix in self.changed)
+
+	def country_changes(self):
+		"""[(prefix, old country, new country)] of the prefixes which moved to another country"""
+		return(sorted((prefix, old.country, new.country) for prefix, (old, new) in self.changed.items()
+			if old.country != new.country))
+
+	def zone_changes(self):
+		"""[(prefix, (old CQ zone, old ITU zone), (new CQ zone, new ITU zone))] of the prefixes which moved to another zone"""
+		return(sorted((prefix, (old.cqz, old.ituz), (new.cqz, new.ituz)) for prefix, (old, new) in self.changed.items()
+			if (old.cqz, old.ituz) != (new.cqz, new.ituz)))
+
+	def affects(self, call, prefix):
+		""" True if a call which has been resolved to prefix (False if it could not be resolved)
+		may be resolved differently with the new version of the Country File"""
+		if self._extended is None: #a new prefix which extends the old one can be a longer match now
+			self._extended = set(new[:i] for new in self.new_prefixes() for i in range(1, len(new)))
+		if not prefix:
+			return(bool(self._extended) or bool(self.added))
+		if prefix in self.changed or prefix in self.removed or call in self.added:
+			return(True)
+		return(prefix in self._extended)
+
+	def new_prefixes(self):
+		""" prefixes which take part in the prefix search now: the added ones and those which
+		lost the ExactCallsign flag"""
+		return([prefix for prefix in self.added] +
+			[prefix for prefix, (old, new) in self.changed.items() if old.exact and not new.exact])
+
+	def report(self):
+		"""human readable list of the changes"""
+		lines = ["added %s (%s)" % (prefix, self.added[prefix].country) for prefix in sorted(self.added)]
+		lines += ["removed %s (%s)" % (prefix, self.removed[prefix].country) for prefix in sorted(self.removed)]
+		for prefix in sorted(self.changed):
+			old, new = self.changed[prefix]
+			fields = ["%s %s -> %s" % (key, old[key], new[key]) for key in CtyEntry.KEYS if old[key] != new[key]]
+			lines.append("changed %s: %s" % (prefix, ", ".join(fields)))
+		return(lines)
+
+def build_indexes(country_list):
+	""" Split the Country File into a set of exact callsigns (entries with the ExactCallsign
+	flag, which only match the complete call) and a PrefixIndex over all other entries"""
+	exact_calls = set()
+	index = PrefixIndex()
+	for key, entry in country_list.items():
+		if entry.exact:
+			exact_calls.add(key)
+		else:
+			index.add(key)
+	return(frozenset(exact_calls), index)
+
+class PrefixIndex(object):
+	"""Character trie over the prefixes of the Country File; returns the longest
+	prefix of a callsign which is contained in the Country File in a single pass"""
+
+	_TERMINAL = "" #key under which a node stores the prefix ending at this node
+
+	def __init__(self, prefixes=()):
+		self._root = {}
+		self._size = 0
+		for prefix in prefixes:
+			self.add(prefix)
+
+	def __len__(self):
+		return(self._size)
+
+	def __contains__(self, prefix):
+		node = self._root
+		for char in prefix:
+			node = node.get(char)
+			if node is None:
+				return(False)
+		return(PrefixIndex._TERMINAL in node)
+
+	def add(self, prefix):
+		"""add a prefix to the index"""
+		node = self._root
+		for char in prefix:
+			node = node.setdefault(char, {})
+		if PrefixIndex._TERMINAL not in node:
+			self._size += 1
+		node[PrefixIndex._TERMINAL] = prefix
+
+	def updated(self, added=(), removed=()):
+		""" Copy of the index with prefixes added and removed. Only the nodes along the paths
+		of these prefixes are copied; the index itself is left untouched for its readers"""
+		terminal = PrefixIndex._TERMINAL
+		index = PrefixIndex()
+		index._root = dict(self._root)
+		index._size = self._size
+		owned = set([id(index._root)])
+		for prefix in removed:
+			if prefix not in index:
+				continue
+			path = index._copy_path(prefix, owned)
+			del path[-1][terminal]
+			index._size -= 1
+			for i in range(len(prefix), 0, -1): #prune the nodes which don't lead to a prefix any more
+				if path[i]:
+					break
+				del path[i - 1][prefix[i - 1]]
+		for prefix in added:
+			node = index._copy_path(prefix, owned)[-1]
+			if terminal not in node:
+				index._size += 1
+			node[terminal] = prefix
+		return(index)
+
+	def _copy_path(self, prefix, owned):
+		"""nodes from the root to prefix; nodes which are shared with another index are copied first"""
+		node = self._root
+		path = [node]
+		for char in prefix:
+			child = node.get(char)
+			if child is None:
+				child = {}
+			elif id(child) not in owned:
+				child = dict(child)
+			owned.add(id(child))
+			node[char] = child
+			path.append(child)
+			node = child
+		return(path)
+
+	def longest_prefix(self, call):
+		"""longest prefix in the index with which call starts; empty string if there is none"""
+		if " " in call:
+			call = call.replace(" ", "")
+		terminal = PrefixIndex._TERMINAL
+		node = self._root
+		match = ""
+		for char in call:
+			node = node.get(char)
+			if node is None:
+				break
+			match = node.get(terminal, match)
+		return(match)
+
+
+class CtyTables(object):
+	""" Everything which is derived from one version of the Country File. A CtyTables object
+	is never modified after it has been built, so a decoder which holds on to it sees a
+	consistent database while a new one is swapped in.
+
+	The country information is stored once per DXCC entity (self.entities, a list of CtyInfo
+	records) and every prefix is mapped to the id of its entity (self.entity_ids). Prefixes
+	whose zones or location differ from their entity have an override record instead; equal
+	overrides are shared as well. lookup() returns these records without copying them"""
+
+	def __init__(self, dxcc, filename=None, stat=None, checksum=None, previous=None, changes=None):
+		self.dxcc = dxcc
+		self.filename = filename
+		self.stat = stat #(mtime, size) of the file when it has been loaded
+		self.checksum = checksum #SHA1 digest of the file
+		self.changes = changes #CtyDiff against the previous tables; None if they have been built from scratch
+		if previous is None or changes is None or not previous.dxcc:
+			self.exact_calls, self.prefix_index = build_indexes(dxcc)
+			self._build_entities()
+			return
+		# only the entries which have changed are applied to copies of the previous indexes
+		old_exact = [prefix for prefix in changes.removed if changes.removed[prefix].exact]
+		old_exact += [prefix for prefix in changes.changed if changes.changed[prefix][0].exact]
+		new_exact = [prefix for prefix in changes.added if changes.added[prefix].exact]
+		new_exact += [prefix for prefix in changes.changed if changes.changed[prefix][1].exact]
+		self.exact_calls = previous.exact_calls.difference(old_exact).union(new_exact)
+		self.prefix_index = previous.prefix_index.updated(
+			added=[prefix for prefix in list(changes.added) + list(changes.changed) if not dxcc[prefix].exact],
+			removed=list(changes.removed) + list(changes.changed))
+		self.entities = list(previous.entities)
+		self._entity_of_country = dict(previous._entity_of_country)
+		self.entity_ids = dict(previous.entity_ids)
+		self.overrides = dict(previous.overrides)
+		self._shared = dict((info, info) for info in self.overrides.values())
+		for prefix in changes.removed:
+			del self.entity_ids[prefix]
+			self.overrides.pop(prefix, None)
+		for prefix in list(changes.added) + list(changes.changed):
+			self._add(prefix, dxcc[prefix])
+		del self._shared
+
+	def __len__(self):
+		return(len(self.dxcc))
+
+	def lookup(self, prefix):
+		"""shared CtyInfo record of a prefix of the Country File; None if it isn't contained"""
+		info = self.overrides.get(prefix)
+		if info is None:
+			entity_id = self.entity_ids.get(prefix)
+			if entity_id is not None:
+				info = self.entities[entity_id]
+		return(info)
+
+	def _build_entities(self):
+		"""one record per entity: the location and zones shared by most of its prefixes"""
+		counts = {}
+		for entry in self.dxcc.values():
+			if not entry.exact:
+				counts.setdefault(entry.country, Counter())[_cty_info(entry)] += 1
+		for entry in self.dxcc.values(): #entities which only consist of exact callsigns
+			if entry.country not in counts:
+				counts.setdefault(entry.country, Counter())[_cty_info(entry)] += 1
+		self.entities = []
+		self._entity_of_country = {}
+		for country in sorted(counts):
+			infos = counts[country]
+			self._entity_of_country[country] = len(self.entities)
+			self.entities.append(max(infos, key=lambda info: (infos[info], info)))
+		self.entity_ids = {}
+		self.overrides = {}
+		self._shared = {}
+		for prefix, entry in self.dxcc.items():
+			self._add(prefix, entry)
+		del self._shared
+
+	def _add(self, prefix, entry):
+		info = _cty_info(entry)
+		entity_id = self._entity_of_country.get(entry.country)
+		if entity_id is None: #new entity (diff update)
+			entity_id = self._entity_of_country[entry.country] = len(self.entities)
+			self.entities.append(info)
+		self.entity_ids[prefix] = entity_id
+		if info == self.entities[entity_id]:
+			self.overrides.pop(prefix, None)
+		else:
+			self.overrides[prefix] = self._shared.setdefault(info, info)
+
+def _cty_info(entry):
+	return(CtyInfo(entry.country, entry.latitude, entry.longitude, entry.cqz, entry.ituz, entry.continent, entry.offset))
+
+def _file_stat(filename):
+	stat = os.stat(filename)
+	return((stat.st_mtime, stat.st_size))
+
+class CountryDatabase(object):
+	""" Reloadable Country File. The current version is available as self.tables; load()
+	builds the tables of a new version first and then replaces self.tables in a single
+	assignment. watch() checks the file periodically in a background thread and reloads
+	it whenever its content has changed"""
+
+	def __init__(self, filename=None):
+		self.filename = filename
+		self.tables = CtyTables({})
+		self.reloads = 0
+		self.last_error = None #exception of the last failed reload of the watcher
+		self._listeners = []
+		self._lock = threading.Lock() #only one reload at a time
+		self._stop = threading.Event()
+		self._watcher = None
+		if filename:
+			self.load(filename)
+
+	def add_listener(self, callback):
+		"""callback(old_tables, new_tables) is called after every swap"""
+		self._listeners.append(callback)
+
+	def load(self, filename=None):
+		""" Load the Country File (default: the current file) and swap it in; raises an
+		Exception and keeps the current tables if the file can't be loaded"""
+		with self._lock:
+			filename = filename or self.filename
+			stat = _file_stat(filename)
+			checksum = plist_checksum(filename)
+			tables = CtyTables(self._read(filename), filename, stat, checksum)
+			self._swap(filename, tables)
+			return(tables)
+
+	def update(self, filename=None):
+		""" Load the Country File (default: the current file; plist, cty.dat or cty.csv) in diff
+		mode: only the entries which have been added, removed or changed are applied to copies
+		of the current indexes. Returns the CtyDiff"""
+		with self._lock:
+			filename = filename or self.filename
+			stat = _file_stat(filename)
+			checksum = plist_checksum(filename)
+			dxcc = self._read(filename)
+			previous = self.tables
+			changes = diff_cty(previous.dxcc, dxcc)
+			self._swap(filename, CtyTables(dxcc, filename, stat, checksum, previous, changes))
+			return(changes)
+
+	def _read(self, filename):
+		dxcc = load_cty(filename)
+		if not dxcc:
+			raise Exception(filename + " could not be loaded!")
+		return(dxcc)
+
+	def _swap(self, filename, tables):
+		old, self.tables = self.tables, tables #atomic; running decoders keep the old tables
+		self.filename = filename
+		self.reloads += 1
+		for callback in self._listeners:
+			callback(old, tables)
+
+	def changed(self):
+		"""True if the content of the file differs from the loaded version"""
+		tables = self.tables
+		if not self.filename:
+			return(False)
+		if self.filename == tables.filename and _file_stat(self.filename) == tables.stat:
+			return(False)
+		return(plist_checksum(self.filename) != tables.checksum) #touched, but maybe not modified
+
+	def check(self):
+		"""update the tables (see update) if the file has changed; returns True if a new version has been loaded"""
+		if self.changed():
+			self.update()
+			return(True)
 		return(False)
 
+	def watch(self, interval=60.0):
+		"""check the file every interval seconds in a background thread"""
+		if self._watcher is None or not self._watcher.is_alive():
+			self._stop.clear()
+			self._watcher = threading.Thread(target=self._watch, args=(interval,), name="CountryDatabase watcher")
+			self._watcher.daemon = True
+			self._watcher.start()
+		return(self._watcher)
+
+	def stop(self):
+		"""stop the background thread started by watch()"""
+		self._stop.set()
+		if self._watcher is not None:
+			self._watcher.join()
+			self._watcher = None
+
+	def _watch(self, interval):
+		while not self._stop.wait(interval):
+			try:
+				self.check()
+				self.last_error = None
+			except Exception as e: #file is being replaced or broken - keep the current tables
+				self.last_error = e
+
+
+if __name__ == "__main__":
+	# Compile the country file: "python cty.py [cty.plist] [cty.bin]"
+	plist_file = sys.argv[1] if len(sys.argv) > 1 else "cty.plist"
+	snapshot_file = sys.argv[2] if len(sys.argv) > 2 else None
+	print("Snapshot written to " + compile_cty(plist_file, snapshot_file))
+
 # End of cty.py
@@ -0,0 +1,161 @@
+#!/usr/bin/python
+# Filename: geo.py
+
+# Great circle distance and bearing between stations. The positions of the Country File are
+# those of the DXCC entities (or of their prefixes with other locations), so the paths between
+# them are computed once per pair and kept in a lazily filled matrix. Note that the Country
+# File counts longitudes positive to the West; all functions here take them positive to the East.
+# Besides, Maidenhead locators are decoded into positions and pulled out of spot comments.
+
+import re
+from collections import namedtuple
+from math import radians, degrees, sin, cos, asin, atan2, sqrt
+from cache import LRUCache
+
+#------------------CONSTANTS --------------------
+EARTH_RADIUS = 6371.0 #km
+PROPAGATION_MODES = ("ES", "F2", "TEP", "TR", "TROPO", "MS", "EME", "AU", "AUE", "FAI", "RS", "SCAT")
+# locators (4, 6 or 8 characters) and propagation modes (also as "<ES>") of a comment, found in a single pass
+RE_COMMENT_LOCATORS = re.compile(r'(?<![A-Za-z0-9])(?:(?P<locator>[A-Ra-r]{2}[0-9]{2}(?:[A-Xa-x]{2}(?:[0-9]{2})?)?)|<?(?P<mode>'
+	+ "|".join(sorted(PROPAGATION_MODES, key=len, reverse=True)) + r')>?)(?![A-Za-z0-9])')
+
+class CommentLocators(namedtuple("CommentLocators", "locators mode source destination")):
+	"""locators (upper case) and propagation mode of a comment like "JN48QT<ES>IM98"; source and
+	destination are the positions of the first two locators (None if missing)"""
+	__slots__ = ()
+
+def great_circle(lat1, lon1, lat2, lon2):
+	"""(distance in km, initial bearing in degrees) from point 1 to point 2 (degrees, longitude positive East)"""
+	phi1 = radians(lat1)
+	phi2 = radians(lat2)
+	delta = radians(lon2 - lon1)
+	a = sin((phi2 - phi1) / 2) ** 2 + cos(phi1) * cos(phi2) * sin(delta / 2) ** 2
+	distance = 2 * EARTH_RADIUS * asin(min(1.0, sqrt(a)))
+	bearing = degrees(atan2(sin(delta) * cos(phi2), cos(phi1) * sin(phi2) - sin(phi1) * cos(phi2) * cos(delta)))
+	return((distance, bearing % 360.0))
+
+def great_circle_array(lat1, lon1, lat2, lon2):
+	""" Vectorized great_circle for NumPy arrays (or scalars) of positions; returns an array of
+	distances in km and an array of bearings in degrees"""
+	import numpy
+	phi1 = numpy.radians(lat1)
+	phi2 = numpy.radians(lat2)
+	delta = numpy.radians(numpy.asarray(lon2, dtype=float) - lon1)
+	a = numpy.sin((phi2 - phi1) / 2) ** 2 + numpy.cos(phi1) * numpy.cos(phi2) * numpy.sin(delta / 2) ** 2
+	distance = 2 * EARTH_RADIUS * numpy.arcsin(numpy.minimum(1.0, numpy.sqrt(a)))
+	bearing = numpy.degrees(numpy.arctan2(numpy.sin(delta) * numpy.cos(phi2),
+		numpy.cos(phi1) * numpy.sin(phi2) - numpy.sin(phi1) * numpy.cos(phi2) * numpy.cos(delta)))
+	return(distance, bearing % 360.0)
+
+locator_cache = LRUCache(4096) #locator -> position; bounded, the same locators come up again and again
+_INVALID = (None,)
+
+def locator_to_position(locator):
+	""" (latitude, longitude) of the center of a Maidenhead locator like "JO70" or "JN48QT";
+	a trailing odd character is ignored. None if the locator is invalid. The results are
+	kept in locator_cache"""
+	position = locator_cache.get(locator)
+	if position is None:
+		position = _decode_locator(locator)
+		locator_cache.put(locator, _INVALID if position is None else position)
+	elif position is _INVALID:
+		return(None)
+	return(position)
+
+def _decode_locator(locator):
+	locator = locator[:len(locator) & ~1].upper()
+	if len(locator) < 2 or len(locator) > 8:
+		return(None)
+	lon = -180.0
+	lat = -90.0
+	lon_size = 20.0
+	lat_size = 10.0
+	for pair, (base, count, step) in enumerate((("A", 18, 1.0), ("0", 10, 10.0), ("A", 24, 24.0), ("0", 10, 10.0))):
+		if 2 * pair >= len(locator):
+			break
+		x = ord(locator[2 * pair]) - ord(base)
+		y = ord(locator[2 * pair + 1]) - ord(base)
+		if not (0 <= x < count and 0 <= y < count):
+			return(None)
+		lon_size /= step
+		lat_size /= step
+		lon += x * lon_size
+		lat += y * lat_size
+	return((lat + lat_size / 2, lon + lon_size / 2))
+
+def comment_locators(comment):
+	"""CommentLocators of a spot comment; the locators and the mode are found in a single pass"""
+	locators = []
+	mode = None
+	for match in RE_COMMENT_LOCATORS.finditer(comment):
+		locator = match.group("locator")
+		if locator is not None:
+			locators.append(locator.upper())
+		elif mode is None:
+			mode = match.group("mode")
+	source = locator_to_position(locators[0]) if locators else None
+	destination = locator_to_position(locators[1]) if len(locators) > 1 else None
+	return(CommentLocators(tuple(locators), mode, source, destination))
+
+def cty_position(cty_info):
+	"""(latitude, longitude positive East) of a record of the Country File"""
+	return((cty_info.latitude, -cty_info.longitude))
+
+
+class PathMatrix(object):
+	""" Distance and bearing between the locations of one version of the Country File
+	(CtyTables). The entity records get the entity ids as row / column numbers, the records
+	of prefixes with other locations (tables.overrides) the following numbers. A row is
+	allocated when a path from its location is needed for the first time and a path is
+	computed when it is needed for the first time"""
+
+	def __init__(self, tables):
+		self.tables = tables
+		records = list(tables.entities)
+		known = set(id(info) for info in records)
+		for info in tables.overrides.values():
+			if id(info) not in known:
+				known.add(id(info))
+				records.append(info)
+		self._records = records #keeps the records alive, their ids are used as keys
+		self._ids = dict((id(info), i) for i, info in enumerate(records))
+		self._positions = [cty_position(info) for info in records]
+		self._rows = [None] * len(records)
+
+	def __len__(self):
+		return(len(self._records))
+
+	def path(self, source, target):
+		"""(distance, bearing) between two CtyInfo records, e.g. Station.cty_info"""
+		i = self._ids.get(id(source))
+		j = self._ids.get(id(target))
+		if i is None or j is None: #record of another version of the Country File
+			return(great_circle(*(cty_position(source) + cty_position(target))))
+		row = self._rows[i]
+		if row is None:
+			row = self._rows[i] = [None] * len(self._records)
+		path = row[j]
+		if path is None:
+			path = row[j] = great_circle(*(self._positions[i] + self._positions[j]))
+		return(path)
+
+_matrix = None
+
+def path_matrix(tables):
+	"""PathMatrix of the tables; it is rebuilt whenever another version of the Country File is used"""
+	global _matrix
+	matrix = _matrix
+	if matrix is None or matrix.tables is not tables:
+		matrix = _matrix = PathMatrix(tables)
+	return(matrix)
+
+def station_path(spotter, dx, tables, locator=None):
+	""" (distance, bearing) from the spotter to the DX station (Station objects). The position
+	of the spotter is refined by its Maidenhead locator if there is one"""
+	if locator:
+		position = locator_to_position(locator)
+		if position is not None:
+			return(great_circle(*(position + cty_position(dx.cty_info))))
+	return(path_matrix(tables).path(spotter.cty_info, dx.cty_info))
+
+# End of geo.py
@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# Filename: metrics.py
+
+# Counters and latency histograms of the decoding pipeline. The parsers of spot_processing
+# count every record by outcome and every failure by its reason (the things which otherwise
+# only show up as log messages) and time the stages of the decoding. A counter increment is
+# a dict update and an observation a binary search in the bucket bounds, so the metrics can
+# stay on at full feed rate. Export them with registry.as_dict() or registry.prometheus().
+# Increments are not locked; use one registry per process (e.g. the workers of bulk.py each
+# have their own).
+
+from bisect import bisect_left
+from timeit import default_timer as clock #time.perf_counter on Python 3, the best timer of the platform on Python 2
+
+#------------------CONSTANTS --------------------
+NAMESPACE = "dxcsucker" #prefix of the metric names
+LATENCY_BUCKETS = (1e-06, 2e-06, 5e-06, 1e-05, 2e-05, 5e-05, 0.0001, 0.0002, 0.0005, 0.001, 0.01, 0.1) #seconds
+
+def _escape(value):
+	return(str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+
+def _format(value):
+	if isinstance(value, float):
+		return(repr(value))
+	return(str(value))
+
+class Counter(object):
+	""" Monotonic counter with one value per combination of labels. inc() takes the label
+	value (a tuple of values if the counter has more than one label)"""
+	kind = "counter"
+
+	def __init__(self, name, help, labels):
+		self.name = name
+		self.help = help
+		self.labels = labels
+		self.values = {}
+
+	def inc(self, key, amount=1):
+		values = self.values
+		values[key] = values.get(key, 0) + amount
+
+	def get(self, key):
+		return(self.values.get(key, 0))
+
+	def reset(self):
+		self.values.clear()
+
+	def as_dict(self):
+		"""label values (joined with "/") -> count"""
+		return(dict(("/".join(key) if isinstance(key, tuple) else key, value) for key, value in self.values.items()))
+
+	def samples(self):
+		"""(name suffix, labels, value) of every series"""
+		for key in sorted(self.values):
+			yield("_total", self._labels(key), self.values[key])
+
+	def _labels(self, key):
+		if not isinstance(key, tuple):
+			key = (key,)
+		return(list(zip(self.labels, key)))
+
+
+class Histogram(Counter):
+	""" Distribution of observed values (e.g. seconds) in fixed buckets, one per label value.
+	The counts are stored per bucket and accumulated on export"""
+	kind = "histogram"
+
+	def __init__(self, name, help, labels, buckets=LATENCY_BUCKETS):
+		Counter.__init__(self, name, help, labels)
+		self.buckets = tuple(sorted(buckets))
+		self.sums = {}
+
+	def observe(self, key, value):
+		counts = self.values.get(key)
+		if counts is None:
+			counts = self.values[key] = [0] * (len(self.buckets) + 1) #the last bucket is +Inf
+			self.sums[key] = 0.0
+		counts[bisect_left(self.buckets, value)] += 1
+		self.sums[key] += value
+
+	def get(self, key):
+		"""number of observations"""
+		return(sum(self.values.get(key, ())))
+
+	def reset(self):
+		self.values.clear()
+		self.sums.clear()
+
+	def cumulative(self, key):
+		"""[(upper bound, number of observations <= bound)], the last bound is float("inf")"""
+		result = []
+		total = 0
+		for bound, count in zip(self.buckets + (float("inf"),), self.values.get(key, ())):
+			total += count
+			result.append((bound, total))
+		return(result)
+
+	def quantile(self, key, q):
+		"""upper bound of the bucket which holds the q-quantile (0 < q <= 1); None without observations"""
+		counts = self.values.get(key)
+		if not counts:
+			return(None)
+		rank = q * sum(counts)
+		for bound, total in self.cumulative(key):
+			if total >= rank:
+				return(bound)
+
+	def as_dict(self):
+		"""label values -> {"count", "sum", "buckets": {upper bound: cumulative count}}"""
+		result = {}
+		for key in self.values:
+			name = "/".join(key) if isinstance(key, tuple) else key
+			buckets = self.cumulative(key)
+			result[name] = {"count": buckets[-1][1], "sum": self.sums[key],
+				"buckets": dict((_format(bound) if bound != float("inf") else "+Inf", total) for bound, total in buckets)}
+		return(result)
+
+	def samples(self):
+		for key in sorted(self.values):
+			labels = self._labels(key)
+			for bound, total in self.cumulative(key):
+				yield("_bucket", labels + [("le", "+Inf" if bound == float("inf") else _format(bound))], total)
+			yield("_sum", labels, self.sums[key])
+			yield("_count", labels, sum(self.values[key]))
+
+
+class Metrics(object):
+	"""Registry of counters and histograms; the names get the namespace as prefix on export"""
+
+	def __init__(self, namespace=NAMESPACE):
+		self.namespace = namespace
+		self.metrics = []
+
+	def _register(self, metric):
+		if [m for m in self.metrics if m.name == metric.name]:
+			raise ValueError("duplicate metric: " + metric.name)
+		self.metrics.append(metric)
+		return(metric)
+
+	def counter(self, name, help, labels):
+		return(self._register(Counter(name, help, tuple(labels))))
+
+	def histogram(self, name, help, labels, buckets=LATENCY_BUCKETS):
+		return(self._register(Histogram(name, help, tuple(labels), buckets)))
+
+	def reset(self):
+		"""set all metrics back to zero"""
+		for metric in self.metrics:
+			metric.reset()
+
+	def as_dict(self):
+		"""{metric name: metric.as_dict()}, e.g. to log it as JSON"""
+		return(dict((metric.name, metric.as_dict()) for metric in self.metrics))
+
+	def prometheus(self):
+		"""all metrics in the Prometheus text exposition format (version 0.0.4)"""
+		lines = []
+		for metric in self.metrics:
+			name = self.namespace + "_" + metric.name if self.namespace else metric.name
+			lines.append("# HELP %s %s" % (name + ("_total" if metric.kind == "counter" else ""), metric.help))
+			lines.append("# TYPE %s %s" % (name + ("_total" if metric.kind == "counter" else ""), metric.kind))
+			for suffix, labels, value in metric.samples():
+				if labels:
+					labels = "{" + ",".join('%s="%s"' % (label, _escape(text)) for label, text in labels) + "}"
+				else:
+					labels = ""
+				lines.append("%s%s%s %s" % (name, suffix, labels, _format(value)))
+		return("\n".join(lines) + "\n")
+
+#------------------PIPELINE METRICS --------------------
+registry = Metrics()
+records = registry.counter("records", "lines by type (spot, wwv, comment, other) and outcome (valid, invalid, ignored)", ("type", "outcome"))
+errors = registry.counter("errors", "reasons why records are invalid, e.g. the field which could not be decoded", ("type", "reason"))
+fallbacks = registry.counter("fallbacks", "lines which needed a slower or tolerant way of decoding", ("reason",))
+stations = registry.counter("stations", "decoded calls (station cache misses) by the way they were resolved", ("resolved_by",))
+stage_seconds = registry.histogram("stage_seconds", "latency of the decoding stages in seconds", ("stage",))
+
+# End of metrics.py
@@ -0,0 +1,144 @@
+#!/usr/bin/python
+# Filename: profiling.py
+
+# Profiling hooks around the stages of Station and Spot decoding. A hook is a callable
+# hook(stage, seconds, instance, args) which is called after every run of the stage with the
+# elapsed time, the Station or Spot and the arguments of the method. The stages are wrapped
+# only while hooks are registered for them; without hooks the classes run their original
+# methods and don't pay anything. Note that Station only decodes on station cache misses.
+
+import sys
+import heapq
+from functools import wraps
+from metrics import clock
+from spot_processing import Station, Spot, parse_lines
+
+#------------------CONSTANTS --------------------
+HOOK_POINTS = { #stage -> (class, method)
+	"obtain_homecall": (Station, "obtain_homecall"),
+	"obtain_prefix": (Station, "obtain_prefix"),
+	"lookup_cty_info": (Station, "lookup_cty_info"),
+	"process_spot": (Spot, "_Spot__process_spot"),
+	"convert_freq_to_band": (Spot, "convert_freq_to_band"),
+}
+STATION_STAGES = ("obtain_homecall", "obtain_prefix", "lookup_cty_info")
+REPORT_SIZE = 20 #inputs in a report
+REPORT_CAPACITY = 10000 #distinct inputs kept by a report before the cheap ones are dropped
+
+hooks = dict((stage, []) for stage in HOOK_POINTS) #stage -> registered hooks
+_originals = {} #stage -> original method while it is wrapped
+
+def _wrap(stage, method):
+	stage_hooks = hooks[stage]
+	@wraps(method)
+	def wrapper(self, *args, **kwargs):
+		start = clock()
+		try:
+			return(method(self, *args, **kwargs))
+		finally:
+			seconds = clock() - start
+			for hook in list(stage_hooks):
+				hook(stage, seconds, self, args)
+	return(wrapper)
+
+def add_hook(stage, hook):
+	"""call hook(stage, seconds, instance, args) after every run of a stage (a key of HOOK_POINTS)"""
+	if stage not in HOOK_POINTS:
+		raise ValueError("unknown stage: " + stage)
+	cls, name = HOOK_POINTS[stage]
+	if stage not in _originals:
+		method = cls.__dict__[name]
+		_originals[stage] = method
+		setattr(cls, name, _wrap(stage, method))
+	hooks[stage].append(hook)
+
+def remove_hook(stage, hook):
+	"""unregister a hook; the original method is restored when the last hook of a stage is gone"""
+	hooks[stage].remove(hook)
+	if not hooks[stage] and stage in _originals:
+		cls, name = HOOK_POINTS[stage]
+		setattr(cls, name, _originals.pop(stage))
+
+def remove_all_hooks():
+	for stage in HOOK_POINTS:
+		for hook in list(hooks[stage]):
+			remove_hook(stage, hook)
+
+
+class SlowestInputs(object):
+	""" Hook which adds up the time per input and reports the most expensive ones. The input of
+	the Station stages is the call (so the time of a call is the sum of its stages), of
+	process_spot the line and of convert_freq_to_band the frequency. Use it as a context manager
+	or call install() and remove(); at most capacity inputs are kept, beyond that only the
+	size most expensive survive"""
+
+	def __init__(self, size=REPORT_SIZE, stages=STATION_STAGES, capacity=REPORT_CAPACITY):
+		self.size = size
+		self.stages = tuple(stages)
+		self.capacity = max(capacity, size)
+		self.inputs = {} #input -> {stage: seconds}
+		self.totals = {} #input -> seconds
+
+	def __call__(self, stage, seconds, instance, args):
+		key = instance.call if isinstance(instance, Station) else (args[0] if args else None)
+		stages = self.inputs.get(key)
+		if stages is None:
+			if len(self.inputs) >= self.capacity:
+				self._prune()
+			stages = self.inputs[key] = {}
+			self.totals[key] = 0.0
+		stages[stage] = stages.get(stage, 0.0) + seconds
+		self.totals[key] += seconds
+
+	def _prune(self):
+		keep = set(heapq.nlargest(self.size, self.totals, key=self.totals.get))
+		for key in list(self.inputs):
+			if key not in keep:
+				del self.inputs[key]
+				del self.totals[key]
+
+	def install(self):
+		for stage in self.stages:
+			add_hook(stage, self)
+		return(self)
+
+	def remove(self):
+		for stage in self.stages:
+			remove_hook(stage, self)
+
+	def __enter__(self):
+		return(self.install())
+
+	def __exit__(self, exc_type, exc, tb):
+		self.remove()
+
+	def slowest(self, size=None):
+		"""[(input, total seconds, {stage: seconds})], the most expensive first"""
+		keys = heapq.nlargest(size or self.size, self.totals, key=self.totals.get)
+		return([(key, self.totals[key], dict(self.inputs[key])) for key in keys])
+
+	def report(self, size=None):
+		"""the slowest inputs as a table with the microseconds per stage"""
+		lines = ["%-20s %10s  %s" % ("input", "total us", "  ".join("%15s" % stage for stage in self.stages))]
+		for key, total, stages in self.slowest(size):
+			lines.append("%-20s %10.1f  %s" % (str(key)[:20], total * 1e6,
+				"  ".join("%15.1f" % (stages.get(stage, 0.0) * 1e6) for stage in self.stages)))
+		return("\n".join(lines))
+
+def slowest_calls(lines, size=REPORT_SIZE):
+	""" Decode lines (e.g. an open file) with an empty station cache and return SlowestInputs
+	of the calls"""
+	Station.cache.clear() #every call is decoded once
+	with SlowestInputs(size) as slowest:
+		for record in parse_lines(lines):
+			pass
+	return(slowest)
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print("usage: python profiling.py cluster.log [number of calls]")
+		sys.exit(1)
+	with open(sys.argv[1]) as f:
+		print(slowest_calls(f, int(sys.argv[2]) if len(sys.argv) > 2 else REPORT_SIZE).report())
+
+# End of profiling.py
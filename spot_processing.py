@@ -5,17 +5,72 @@ import re
 import pytz
 from pytz import timezone
 from datetime import datetime, time, date, tzinfo
-from cty import load_cty
+from cty import CountryDatabase
+from cache import LRUCache
+from bandplan import load_band_plan
+from timestamps import TimestampResolver
+from geo import station_path, locator_to_position, comment_locators
+import metrics
+from metrics import clock
 import logging
 import os.path
+from operator import attrgetter
+from itertools import count
 
 #------------------CONSTANTS --------------------
 UTC = pytz.utc
+RESOLVED_EXACT = "exact" #Station.resolved_by: the call has its own entry in the Country File
+RESOLVED_PREFIX = "prefix" #Station.resolved_by: the call has been resolved through its prefix
 root_logger = "dxcsucker"
+logger = logging.getLogger(root_logger) #shared by all classes; configure it in your application
+logger.addHandler(logging.NullHandler()) #no "No handlers could be found" warning if the application doesn't
+
+#------------------REGULAR EXPRESSIONS --------------------
+# compiled once; groups are used to extract the interesting part of a match
+RE_HOMECALL = re.compile(r'[\d]{0,1}[A-Z]{1,2}\d([A-Z]{1,4}|\d{3,3}|\d{1,3}[A-Z])[A-Z]{0,5}', re.I)
+RE_NORMAL_CALL = re.compile(r'^[\d]{0,1}[A-Z]{1,2}\d([A-Z]{1,4}|\d{3,3}|\d{1,3}[A-Z])[A-Z]{0,5}$', re.I)
+RE_CALL_CHARS = re.compile(r'[/A-Z0-9\-]{3,15}', re.I)
+RE_SSID = re.compile(r'\-\d{1,3}$') # DB0SUE-10
+RE_SECOND_APPENDIX = re.compile(r'/[A-Z0-9]{2,4}(/[A-Z0-9]{1,4})$') # DH1TW/HC2/P
+RE_LONG_APPENDIX = re.compile(r'/([A-Z0-9]{2,4})$') # DH1TW/VP5
+RE_SHORT_APPENDIX = re.compile(r'/([A-Z0-9])$') # DH1TW/P
+RE_COUNTRY_PREFIX = re.compile(r'^([A-Z0-9]{1,4})/') # VP5/DH1TW
+RE_DIGITS = re.compile(r'[\d]+')
+
+RE_SPOTTER_CALL = re.compile(r'[A-Za-z0-9\/]+[:$]')
+RE_FREQUENCY = re.compile(r'[0-9\.]{5,12}')
+RE_NON_FREQUENCY_CHARS = re.compile(r'[^0-9\.]+')
+RE_NON_CALL_CHARS = re.compile(r'[^A-Za-z0-9\/]+')
+RE_NON_SPOT_COMMENT_CHARS = re.compile(r'[^\sA-Za-z0-9\.,;\#\+\-!\?\$\(\)@\/]+')
+RE_NON_DIGITS = re.compile(r'[^0-9]+')
+RE_NON_ALNUM = re.compile(r'[^A-Za-z0-9]+')
+# "DX de" line in the standard column layout (split_spot). The lookahead checks the fixed columns
+# from 26 on: dx call (12 columns), comment (30), time (4 digits) and the optional locator; then
+# come the spotter call (3 to 8 characters) with its colon and the frequency, which has to end
+# before column 25
+RE_SPOT_LAYOUT = re.compile(r'(?=.{26}([A-Za-z0-9/ ]{12}).(.{30}).([0-9]{2})([0-9]{2})(?:.([A-Za-z0-9 ]{0,5}))?\s*$)'
+	r'.{6}([A-Za-z0-9/]{3,8}): *([0-9.]{5,12}) *', re.S)
+
+RE_WWV_STATION = re.compile(r'\s[\-A-Z0-9/]{3,10}\s', re.I)
+RE_WWV_HOUR = re.compile(r'<([\d]{2})>')
+RE_WWV_A = re.compile(r'A=(\d{1,3})')
+RE_WWV_SFI = re.compile(r'SFI=(\d{1,3})')
+RE_WWV_K = re.compile(r'\sK=(\d{1,3})')
+RE_WWV_EXPK = re.compile(r'expK=(\d{1,3})')
+RE_WWV_R = re.compile(r'R=(\d{1,3})')
+RE_WWV_AURORA = re.compile(r'Au=(\S{2,3})')
+
+RE_TO_ALL = re.compile(r'^To ALL de', re.I)
+RE_COMMENT_STATION = re.compile(r'de [\-A-Z0-9/]{4,15}', re.I)
+RE_COMMENT_TEXT = re.compile(r':[\S\s]+')
+RE_NON_COMMENT_CHARS = re.compile(r'[^A-Za-z0-9\.,@&\?;\-\#\+!\$\(\)\/]+')
 
 def get_configured_logger(name):
+	""" Optional helper for applications: attaches a console handler and a file handler
+	(spot_processing.log) to the root logger if the logger has no handlers yet. The classes
+	of this module don't call it; they only log through the module level logger"""
 	logger = logging.getLogger(name)
-	if (len(logger.handlers) == 0):
+	if not [handler for handler in logger.handlers if not isinstance(handler, logging.NullHandler)]:
 		# This logger has no handlers, so we can assume it hasn't yet been configured
 		# (Configure logger)
 		
@@ -34,7 +89,7 @@ def get_configured_logger(name):
 
 		#Assign Formatter to Handler
 		console_handler.setFormatter(logging.Formatter(formatter_simple))
-		file_handler.setFormatter(logging.Formatter(formatter_verbose))
+		file_handler.setFormatter(logging.Formatter(*formatter_verbose))
 		
 		#Assign Handler to Logger
 		logger.addHandler(console_handler)
@@ -47,553 +102,662 @@ def get_configured_logger(name):
 		
 
 
+def split_spot(line):
+	""" Split a "DX de" line in the standard DX Spider / AR-Cluster column layout into
+	(spotter_call, frequency, dx_call, comment, hour, minute, locator) with a single match of
+	RE_SPOT_LAYOUT instead of a regular expression per field; the fields are the same as those
+	of the regular expressions. The line can be a str, bytes or a memoryview of a socket
+	buffer. Returns None if the line doesn't follow the layout; the regular expressions of
+	Spot take care of these lines"""
+	if line.__class__ is memoryview:
+		line = line.tobytes()
+	if bytes is not str and isinstance(line, (bytes, bytearray)):
+		line = line.decode("ascii", "replace")
+	match = RE_SPOT_LAYOUT.match(line)
+	if match is None or match.end(7) > 25 or match.end() < 25: #the frequency has to end within its column
+		return(None)
+	dx_call, comment, hour, minute, locator, spotter_call, frequency = match.groups()
+	try:
+		frequency = float(frequency)
+	except ValueError: #e.g. "1.2.3.4"
+		return(None)
+	hour = int(hour)
+	minute = int(minute)
+	if hour > 23 or minute > 59:
+		return(None)
+	return(spotter_call, frequency, dx_call.replace(" ", ""), RE_NON_SPOT_COMMENT_CHARS.sub(' ', comment),
+		hour, minute, locator.replace(" ", "") if locator else "")
+
+#------------------Immutable Results --------------------
+_set = object.__setattr__ #the parsers write the attributes of their (otherwise immutable) objects through this
+
+def _immutable(self, name, value):
+	raise AttributeError("'" + self.__class__.__name__ + "' object is immutable")
+
+def _getstate(self):
+	"""values of the slots, for pickle and copy"""
+	return(tuple(getattr(self, name) for name in self.__slots__))
+
+def _setstate(self, state):
+	for name, value in zip(self.__slots__, state):
+		_set(self, name, value)
+
+def _cty_property(field):
+	"""attribute of the shared CtyInfo record of a Station; None if the Station is invalid"""
+	get_field = attrgetter(field)
+	def getter(self):
+		cty_info = self.cty_info
+		if cty_info is None:
+			return(None)
+		return(get_field(cty_info))
+	return(property(getter))
+
+
 class Station(object):
+	""" Callsign decoded with the help of the Country File. Stations are immutable and
+	shared: decoding a call which is still in Station.cache returns the same object"""
+	__slots__ = ('call', 'homecall', 'prefix', 'valid', 'mm', 'am', 'beacon', 'cty_info', 'resolved_by')
+	__setattr__ = _immutable
+
 	#------------------Constructor --------------------
-	def __init__(self, call):
-	#	super(Station, self).__init__()
-		self._logger = get_configured_logger(root_logger)
-		self._logger.propagate = True #send all log events to higher logger which has a handler
-		
-		self.valid = None
-		self.call = None
-		self.prefix = None
-		self.homecall = None
-		self.country = None
-		self.latitude = None
-		self.longitude = None
-		self.cqz = None
-		self.ituz = None
-		self.continent = None
-		self.offset = None
-		self.mm = False
-		self.am = False
-		self.beacon = False
-		self.call = call.rstrip().lstrip().upper()
-		self.homecall = self.obtain_homecall(self.call)
+	def __new__(cls, call):
+		cache = Station.cache #fetched before the tables; replaced after every swap of the Country File
+		station = cache.get(call)
+		if station is None: #not decoded yet
+			station = object.__new__(cls)
+			station.__decode(call, Station.database.tables)
+			cache.put(call, station)
+		return(station)
+
+	def __reduce__(self):
+		return((Station, (self.call,))) #decoded again (or taken from the cache) when unpickled
+
+	def __decode(self, call, tables):
+		_set(self, 'prefix', None)
+		_set(self, 'cty_info', None)
+		_set(self, 'resolved_by', None)
+		_set(self, 'mm', False)
+		_set(self, 'am', False)
+		_set(self, 'beacon', False)
+		stripped_call = call.rstrip().lstrip().upper()
+		_set(self, 'call', call if stripped_call == call else stripped_call) #share the string if possible
+		start = clock()
+		_set(self, 'homecall', self.obtain_homecall(self.call))
+		end = clock()
+		metrics.stage_seconds.observe("homecall", end - start)
+		valid = False
 		if not self.homecall:
-			self.valid = False
-			self._logger.warning("Busted Homecall: '"+ str(self.homecall) + "' of " + self.call + " could not be decoded")
+			logger.warning("Busted Homecall: '%s' of %s could not be decoded", self.homecall, self.call)
+			metrics.errors.inc(("station", "busted_homecall"))
 		else:
-			self.prefix = self.obtain_prefix(self.call)
+			start = end
+			if self.call in tables.exact_calls: #one hash lookup; exact calls never take part in the prefix search
+				_set(self, 'prefix', self.call)
+				_set(self, 'resolved_by', RESOLVED_EXACT)
+			else:
+				_set(self, 'prefix', self.obtain_prefix(self.call, tables))
+				if self.prefix:
+					_set(self, 'resolved_by', RESOLVED_PREFIX)
+			end = clock()
+			metrics.stage_seconds.observe("prefix", end - start)
 			if not self.prefix:
-				self.valid = False
-				if not self.mm and not self.am:
-					self._logger.warning("Busted Prefix: '"+ str(self.prefix) + "' of " + self.call + " could not be decoded")
+				if self.mm:
+					metrics.errors.inc(("station", "maritime_mobile"))
+				elif self.am:
+					metrics.errors.inc(("station", "aeronautical_mobile"))
+				else:
+					logger.warning("Busted Prefix: '%s' of %s could not be decoded", self.prefix, self.call)
+					metrics.errors.inc(("station", "busted_prefix"))
 			else:
-				cty_info = self.lookup_cty_info(self.prefix)
+				cty_info = self.lookup_cty_info(self.prefix, tables)
+				metrics.stage_seconds.observe("cty_lookup", clock() - end)
 				if not cty_info:
-					self.valid = False
-					self._logger.warning("Busted: No Country Info found for " + self.call )
-					
+					logger.warning("Busted: No Country Info found for %s", self.call)
+					metrics.errors.inc(("station", "no_cty_info"))
 				else:
-					self.country = cty_info['country']
-					self.latitude = cty_info['latitude']
-					self.longitude = cty_info['longitude']
-					self.cqz = cty_info['cqz']
-					self.ituz = cty_info['ituz']
-					self.continent = cty_info['continent']
-					self.offset = cty_info['offset']
-					self.valid = True
+					_set(self, 'cty_info', cty_info)
+					valid = True
+		_set(self, 'valid', valid)
+		metrics.stations.inc(self.resolved_by if valid else "invalid")
+
+	country = _cty_property('country')
+	latitude = _cty_property('latitude')
+	longitude = _cty_property('longitude')
+	cqz = _cty_property('cqz')
+	ituz = _cty_property('ituz')
+	continent = _cty_property('continent')
+	offset = _cty_property('offset')
 
 	#------------------STATIC Variables --------------------
-	dxcc = ""
+	database = CountryDatabase() #Country File; every decode works on one version of it (database.tables)
 	try: 
 		if os.path.isfile("./dxcsucker/cty.plist"):
-			dxcc = load_cty("./dxcsucker/cty.plist") #Load Country File
+			database.load("./dxcsucker/cty.plist") #Load Country File
 		elif os.path.isfile("cty.plist"):
-			dxcc = load_cty("cty.plist") #Load Country File
+			database.load("cty.plist") #Load Country File
 		else:
-			self._logger.critical("CTY.PLIST could not be loaded!")
 			raise Exception("cty.plist not found!")
 	except Exception as e:
-		self._logger.exception("CTY.PLIST could not be loaded!")
+		logger.exception("CTY.PLIST could not be loaded!")
 		
-	#------------------Class Methods --------------------		
-	def __iterate_prefix(self, call):
-		"""truncate call until it corresponds to a Prefix in the database"""
-		prefix = call
-		while (prefix in Station.dxcc) != True: 
-			if len(prefix) == 0:
-				break
-			else:
-				prefix = prefix.replace(' ','')[:-1]
-		return(prefix)
+	dxcc = database.tables.dxcc #content of the current Country File
+	cache = LRUCache(16384) #decoded stations by raw callsign
 
+	@classmethod
+	def reload_cty(cls, filename=None):
+		"""(re)load the Country File (default: the current one) and drop all cached stations"""
+		cls.database.load(filename)
+
+	@classmethod
+	def watch_cty(cls, interval=60.0):
+		"""reload the Country File in a background thread whenever it changes"""
+		return(cls.database.watch(interval))
+
+	@classmethod
+	def update_cty(cls, filename=None):
+		""" Load a new version of the Country File in diff mode; only the cached stations
+		which are affected by the changes are dropped. Returns the CtyDiff"""
+		return(cls.database.update(filename))
+
+	@classmethod
+	def _cty_swapped(cls, old, new):
+		cls.dxcc = new.dxcc
+		cache = LRUCache(cls.cache.maxsize) #stations which are still being decoded with the old tables end up in the old cache
+		if new.changes is not None: #diff update: keep the stations which are not affected by the changes
+			for call, station in cls.cache.items():
+				if not new.changes.affects(station.call, station.prefix):
+					cache.put(call, station)
+		cls.cache = cache
+
+	#------------------Class Methods --------------------		
 	def obtain_homecall(self, raw_call):
 		"""verify call and strip off any /ea1 vp5/ /qrp etc"""
 		try:
 			raw_call = raw_call.upper()
 			#--------identify Homecall in case the callsign has an appendix (e.g. call: DH1TW/VP5, homecall: DH1TW) ------------
-			homecall = re.search('[\d]{0,1}[A-Z]{1,2}\d([A-Z]{1,4}|\d{3,3}|\d{1,3}[A-Z])[A-Z]{0,5}', raw_call, re.I)
+			homecall = RE_HOMECALL.search(raw_call)
 			if homecall:
 				homecall = homecall.group(0)
 			else:
 				return(False)
 			return(homecall)
 		except Exception as e:
-			self._logger.debug(str(e))
+			logger.debug("obtain_homecall(): %s", e)
 			return(False)
 	
 	
-	def obtain_prefix(self, call):
+	def obtain_prefix(self, call, tables=None):
+		if tables is None:
+			tables = Station.database.tables
+		longest_prefix = tables.prefix_index.longest_prefix
 		try:
+			debug = logger.isEnabledFor(logging.DEBUG) #checked once; no log record or message is built otherwise
 			entire_call = call.upper()
-			#self._logger.debug("obtain_prefix(): call " + call)
-			if re.search('[/A-Z0-9\-]{3,15}', entire_call, re.I):  #make sure the call has at least 3 characters
+			if RE_CALL_CHARS.search(entire_call):  #make sure the call has at least 3 characters
 				
-				if re.search('\-\d{1,3}$', entire_call, re.I): #cut off any -10 / -02 appendixes
-					call = re.sub('\-\d{1,3}$', '', entire_call)
+				ssid = RE_SSID.search(entire_call)
+				if ssid: #cut off any -10 / -02 appendixes
+					call = entire_call[:ssid.start()]
 				
-				if re.search('/[A-Z0-9]{2,4}/[A-Z0-9]{1,4}$', call):
-					call = re.sub('/[A-Z0-9]{1,4}$', '', call) # cut off 2. appendix DH1TW/HC2/P -> DH1TW/HC2
+				second_appendix = RE_SECOND_APPENDIX.search(call)
+				if second_appendix:
+					call = call[:second_appendix.start(1)] # cut off 2. appendix DH1TW/HC2/P -> DH1TW/HC2
+
+				country_prefix = RE_COUNTRY_PREFIX.match(entire_call)
+				long_appendix = RE_LONG_APPENDIX.search(call)
+				short_appendix = None
+				if not long_appendix:
+					short_appendix = RE_SHORT_APPENDIX.search(call)
 
-				if re.search('/[A-Z0-9]{2,4}$', call):  # case call/xxx, but ignoring /p and /m or /5
-					appendix = re.search('/[A-Z0-9]{1,4}$', call)
-					appendix = re.sub('/', '', appendix.group(0))
-					self._logger.debug("obtain_prefix(): appendix: " + appendix)
+				if long_appendix:  # case call/xxx, but ignoring /p and /m or /5
+					appendix = long_appendix.group(1)
+					if debug:
+						logger.debug("obtain_prefix(): appendix: %s", appendix)
 					
 					if appendix == 'MM': 				# special case Martime Mobile
-						self.mm = True
-						self._logger.debug("obtain_prefix(): return False (case /MM)")
+						_set(self, 'mm', True)
+						if debug:
+							logger.debug("obtain_prefix(): return False (case /MM)")
 						return(False)
 					elif appendix == 'AM':				# special case Aeronautic Mobile
-						self._logger.debug("obtain_prefix(): return False (case /AM)")
-						self.am = True
+						if debug:
+							logger.debug("obtain_prefix(): return False (case /AM)")
+						_set(self, 'am', True)
 						return(False)
 					elif appendix == 'QRP':			# special case QRP
-						call = re.sub('/QRP', '', call)
-						prefix = self.__iterate_prefix(call)
-						self._logger.debug("obtain_prefix(): prefix: "+ str(prefix) + " (case /QRP)")
+						call = call.replace('/QRP', '')
+						prefix = longest_prefix(call)
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s (case /QRP)", prefix)
 					elif appendix == 'QRPP':			# special case QRPP
-						call = re.sub('/QRPP', '', call)
-						prefix = self.__iterate_prefix(call)
-						self._logger.debug("obtain_prefix(): prefix: "+ str(prefix) + " (case /QRPP)")
+						call = call.replace('/QRPP', '')
+						prefix = longest_prefix(call)
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s (case /QRPP)", prefix)
 					elif appendix == 'BCN': #filter all beacons
-						call = re.sub('/BCN', '', call)
-						prefix = self.__iterate_prefix(call)
-						self.beacon = True
-						self._logger.debug("obtain_prefix(): prefix: "+ str(prefix) + " (case /BCN)")
+						call = call.replace('/BCN', '')
+						prefix = longest_prefix(call)
+						_set(self, 'beacon', True)
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s (case /BCN)", prefix)
 					elif appendix == "LH": #Filter all Lighthouses
-						call = re.sub('/LH', '', call)
-						prefix = self.__iterate_prefix(call)
-						self._logger.debug("obtain_prefix(): prefix: "+ str(prefix) + " (case /LH)")
+						call = call.replace('/LH', '')
+						prefix = longest_prefix(call)
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s (case /LH)", prefix)
 					else:
-						prefix = self.__iterate_prefix(re.sub('/', '', appendix))   #check if the appendix is a valid country prefix
-						self._logger.debug("obtain_prefix(): prefix: " + str(prefix) + " using appendix: " + appendix )
+						prefix = longest_prefix(appendix)   #check if the appendix is a valid country prefix
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s using appendix: %s", prefix, appendix)
 				
-				elif re.search('/[A-Z0-9]$', call):  # case call/p or /b /m or /5 etc.
-					appendix = re.search('/[A-Z0-9]$', call)
-					appendix = re.sub('/', '', appendix.group(0))
+				elif short_appendix:  # case call/p or /b /m or /5 etc.
+					appendix = short_appendix.group(1)
 					if appendix == 'B':			#special case Beacon
-						call = re.sub('/B', '', call)
-						prefix = self.__iterate_prefix(call)
-						self.beacon = True
-						self._logger.debug("obtain_prefix(): prefix: "+ str(prefix) + " (case /B)")
-					elif re.search('\d$', appendix):
-						area_nr = re.search('\d$', appendix).group(0)
-						call = re.sub('/\d$', '', call)
-						call = re.sub('[\d]+',area_nr, call)
-						prefix = self.__iterate_prefix(call)
+						call = call.replace('/B', '')
+						prefix = longest_prefix(call)
+						_set(self, 'beacon', True)
+						if debug:
+							logger.debug("obtain_prefix(): prefix: %s (case /B)", prefix)
+					elif appendix.isdigit():
+						area_nr = appendix
+						call = call[:-2] #cut off /5
+						call = RE_DIGITS.sub(area_nr, call)
+						prefix = longest_prefix(call)
 					else:
-						prefix = self.__iterate_prefix(call)
-						self._logger.debug("obtain_prefix(): appendix: " + appendix)
+						prefix = longest_prefix(call)
+						if debug:
+							logger.debug("obtain_prefix(): appendix: %s", appendix)
 				
-				elif re.match('^[\d]{0,1}[A-Z]{1,2}\d([A-Z]{1,4}|\d{3,3}|\d{1,3}[A-Z])[A-Z]{0,5}$', call, re.I):  # normal callsigns
-					prefix = self.__iterate_prefix(call)
-					self._logger.debug("obtain_prefix(): Prefix found: " + str(prefix) )
+				elif RE_NORMAL_CALL.match(call):  # normal callsigns
+					prefix = longest_prefix(call)
+					if debug:
+						logger.debug("obtain_prefix(): Prefix found: %s", prefix)
 				
 				else:
-					if re.search('^[A-Z0-9]{1,4}/', entire_call):  # case xxxx/call
-						pfx = re.search('^[A-Z0-9]{1,4}/', entire_call)
-						pfx = re.sub('/', '', pfx.group(0))
-						prefix = self.__iterate_prefix(pfx)
-						self._logger.debug("obtain_prefix(): country prefix " + pfx)
+					if country_prefix:  # case xxxx/call
+						pfx = country_prefix.group(1)
+						prefix = longest_prefix(pfx)
+						if debug:
+							logger.debug("obtain_prefix(): country prefix %s", pfx)
 					else:
+						if debug:
+							logger.debug("obtain_prefix(): returning False; Invalid callsign %s", call)
 						return(False)
-						self._logger.debug("obtain_prefix(): returning False; Invalid callsign " + call )
 
 				#--------identify Prefix of Callsign ------------
 
-				if re.search('^[A-Z0-9]{1,4}/', entire_call):  # case xxxx/call
-					if re.search('^[A-Z0-9]{4}/', entire_call) and len(entire_call) < 8:
+				if country_prefix:  # case xxxx/call
+					pfx = country_prefix.group(1)
+					if len(pfx) == 4 and len(entire_call) < 8:
 						pass
 					else:
-						pfx = re.search('^[A-Z0-9]{1,4}/', entire_call)
-						pfx = re.sub('/', '', pfx.group(0))
-						prefix = self.__iterate_prefix(pfx)
-						self._logger.debug("obtain_prefix(): country prefix " + pfx)
+						prefix = longest_prefix(pfx)
+						if debug:
+							logger.debug("obtain_prefix(): country prefix %s", pfx)
 					
 				if  prefix == '': #in 
-					self._logger.debug("obtain_prefix(): return False; No Prefix found for " + call )
+					if debug:
+						logger.debug("obtain_prefix(): return False; No Prefix found for %s", call)
 					return(False)
 
 				return(prefix) #everything went well - return prefix
 					
 			else:
+				if debug:
+					logger.debug("obtain_prefix(): return False; No Prefix found for %s", call)
 				return(False)
-				self._logger.debug("obtain_prefix(): return False; No Prefix found for " + call )
 		except Exception as e:
-			self._logger.warning(str(e))
-			self._logger.warning("obtain_prefix(): Exception with call:" +call )
+			logger.warning("obtain_prefix(): Exception with call %s: %s", call, e)
 			return(False)
 			
-	def lookup_cty_info(self, prefix):
+	def lookup_cty_info(self, prefix, tables=None):
+		"""shared CtyInfo record of the entity (or of the zone override) of a prefix; False if it is unknown"""
 		#--------Lookup Prefix in Country Database / File and the variables ------------	
+		if tables is None:
+			tables = Station.database.tables
 		if prefix: 	# if Country information found, fill the variables
-			try:
-				info = {
-				'latitude': Station.dxcc[prefix]['Latitude'],
-				'longitude': Station.dxcc[prefix]['Longitude'],
-				'cqz': Station.dxcc[prefix]['CQZone'],
-				'ituz': Station.dxcc[prefix]['ITUZone'],
-				'country': Station.dxcc[prefix]['Country'],
-				'continent': Station.dxcc[prefix]['Continent'],
-				'offset': Station.dxcc[prefix]['GMTOffset']
-				}
-				return(info)
-
-			except KeyError as e: #catching remaining invalid prefixes like call/023 or call/1C0 
-				self._logger.debug("LookUpCall() - Could not identify prefix of " + prefix + "; "+ str(e))
-				self._logger.debug(call_info)
-				return(False)
-
-			except Exception as e:
-				self._logger.debug("LookUpCall() exception"+ str(e))
-				self._logger.debug(call_info)
+			info = tables.lookup(prefix)
+			if info is None: #catching remaining invalid prefixes like call/023 or call/1C0 
+				logger.debug("LookUpCall() - Could not identify prefix of %s", prefix)
 				return(False)
+			return(info)
 
 		else: 	# busted call
 			return(False)
 
 
+Station.database.add_listener(Station._cty_swapped)
+
+
 class Spot(object):
 	"""Split up a DXCluster line and return the individual fields"""
+	__slots__ = ('raw_spot', 'valid', 'dx_call', 'dx_station', 'spotter_call', 'spotter_station', 'frequency', 'time',
+		'comment', 'mode', 'band', 'locator')
+	__setattr__ = _immutable
+	__getstate__ = _getstate
+	__setstate__ = _setstate
+	keep_raw_spot = True #set to False to drop the raw line after decoding
+	fast_path = True #decode lines in the standard column layout with split_spot (see benchmark.py); False: regular expressions only
+	band_plan = load_band_plan() #replace with load_band_plan(region="1") etc. for the IARU band plans
+	timestamps = TimestampResolver() #dates the spot times; TimestampResolver(date=...) when replaying an archive
+	timing = 16 #every timing-th spot is timed for metrics.stage_seconds; 0 turns the timing off
+	_ticks = count()
+
 	def __init__(self, raw_spot):
 		#super(Spot, self).__init__()
-		self._logger = get_configured_logger(root_logger)
-		self._logger.propagate = True #send all log events to higher logger which has a handler
-		self.raw_spot = raw_spot
-		self.valid = None
-		self.dx_call = None
-		self.spotter_call = None
-		self.spotter_station = None
-		self.frequency = None
-		self.time = None
-		self.comment = ""
-		self.mode = None
-		self.band = None
-		self.locator = None
-		if self.__process_spot(raw_spot):
-			self.dx_station = Station(self.dx_call)
-			self.spotter_station = Station(self.spotter_call)
+		start = clock() if Spot.timing and not next(Spot._ticks) % Spot.timing else None
+		if raw_spot.__class__ is memoryview:
+			raw_spot = raw_spot.tobytes()
+		if bytes is not str and isinstance(raw_spot, (bytes, bytearray)): #straight from the socket
+			raw_spot = raw_spot.decode("ascii", "replace")
+		fields = split_spot(raw_spot) if Spot.fast_path else None
+		_set(self, 'raw_spot', raw_spot if Spot.keep_raw_spot else None)
+		if fields is None: #the regular expressions may fail on any field; the fast path sets all of them
+			if Spot.fast_path:
+				metrics.fallbacks.inc("layout")
+			_set(self, 'valid', None)
+			_set(self, 'dx_call', None)
+			_set(self, 'spotter_call', None)
+			_set(self, 'spotter_station', None)
+			_set(self, 'dx_station', None)
+			_set(self, 'frequency', None)
+			_set(self, 'time', None)
+			_set(self, 'comment', "")
+			_set(self, 'mode', None)
+			_set(self, 'band', None)
+			_set(self, 'locator', None)
+		if self.__process_spot(raw_spot, fields):
+			if start is not None:
+				end = clock()
+				metrics.stage_seconds.observe("split", end - start)
+				band, mode = self.convert_freq_to_band(self.frequency)
+				metrics.stage_seconds.observe("band", clock() - end)
+			else:
+				band, mode = self.convert_freq_to_band(self.frequency)
+			_set(self, 'band', band)
+			_set(self, 'mode', mode)
+			_set(self, 'dx_station', Station(self.dx_call))
+			_set(self, 'spotter_station', Station(self.spotter_call))
 			if self.dx_station.valid & self.spotter_station.valid:
-				self.valid = True
+				_set(self, 'valid', True)
+				metrics.records.inc(("spot", "valid"))
 			else:
-				self.valid = False
-		else: self.valid = False
+				_set(self, 'valid', False)
+				metrics.records.inc(("spot", "invalid"))
+				metrics.errors.inc(("spot", "spotter_station" if self.dx_station.valid else "dx_station"))
+		else:
+			_set(self, 'valid', False)
+			metrics.records.inc(("spot", "invalid"))
 
 	def convert_freq_to_band(self, freq):
 		"""converts a frequency into the band and looks up the mode"""
-		band = 0
-		mode = "unknown"
-		if ((freq >=135) and (freq <=138)): 
-			band = 2190
-			mode = "CW"
-		elif ((freq >=1800) and (freq <=2000)): 
-			band = 160
-			if ((freq >=1800) and (freq <=1838)):
-				mode = "CW"
-			elif ((freq >1838) and (freq <=1840)):
-				mode = "DIGITAL"
-			elif ((freq >1840) and (freq <=2000)):
-				mode = "LSB"
-		elif ((freq >=3500) and (freq <=4000)): 
-			band = 80
-			if ((freq >=3500) and (freq <=3580)):
-				mode = "CW"
-			elif ((freq >3580) and (freq <=3600)):
-				mode = "DIGITAL"
-			elif ((freq >3600) and (freq <=4000)):
-				mode = "LSB"
-		elif ((freq >=5000) and (freq <=5500)): 
-			band = 60
-		elif ((freq >=7000) and (freq <=7300)): 
-			band = 40
-			if ((freq >=7000) and (freq <=7040)):
-				mode = "CW"
-			elif ((freq >7040) and (freq <=7050)):
-				mode = "DIGITAL"
-			elif ((freq >7050) and (freq <=7300)):
-				mode = "LSB"
-		elif ((freq >=10100) and (freq <=10150)): 
-			band = 30
-			if ((freq >=10100) and (freq <=10140)):
-				mode = "CW"
-			elif ((freq >10140) and (freq <=10150)):
-				mode = "DIGITAL"
-		elif ((freq >=14000) and (freq <=14350)): 
-			band = 20
-			if ((freq >=14000) and (freq <=14070)):
-				mode = "CW"
-			elif ((freq >14070) and (freq <=14099)):
-				mode = "DIGITAL"
-			elif ((freq >14100) and (freq <=14350)):
-				mode = "USB"
-		elif ((freq >=18068) and (freq <=18268)): 
-			band = 17
-			if ((freq >=18068) and (freq <=18095)):
-				mode = "CW"
-			elif ((freq >18095) and (freq <=18110)):
-				mode = "DIGITAL"
-			elif ((freq >18110) and (freq <=18268)):
-				mode = "USB"
-		elif ((freq >=21000) and (freq <=21450)): 
-			band = 15
-			if ((freq >=21000) and (freq <=21070)):
-				mode = "CW"
-			elif ((freq >21070) and (freq <=21150)):
-				mode = "DIGITAL"
-			elif ((freq >21150) and (freq <=21450)):
-				mode = "USB"
-		elif ((freq >=24890) and (freq <=24990)): 
-			band = 12
-			if ((freq >=24890) and (freq <=24915)):
-				mode = "CW"
-			elif ((freq >24915) and (freq <=24930)):
-				mode = "DIGITAL"
-			elif ((freq >24930) and (freq <=24990)):
-				mode = "USB"
-		elif ((freq >=28000) and (freq <=29700)): 
-			band = 10
-			if ((freq >=28000) and (freq <=28070)):
-				mode = "CW"
-			elif ((freq >28070) and (freq <=28190)):
-				mode = "DIGITAL"
-			elif ((freq >28300) and (freq <=29700)):
-				mode = "USB"
-		elif ((freq >=50000) and (freq <=54000)): 
-			band = 6
-			if ((freq >=50000) and (freq <=50100)):
-				mode = "CW"
-			elif ((freq >50100) and (freq <=50500)):
-				mode = "USB"
-			elif ((freq >50500) and (freq <=51000)):
-				mode = "DIGITAL"
-		elif ((freq >=70000) and (freq <=71000)): 
-			band = 4
-			mode = "unknown"
-		elif ((freq >=144000) and (freq <=148000)): 
-			band = 2
-			if ((freq >=144000) and (freq <=144150)):
-				mode = "CW"
-			elif ((freq >144150) and (freq <=144400)):
-				mode = "USB"
-			elif ((freq >144400) and (freq <=148000)):
-				mode = "unknown"
-		elif ((freq >=220000) and (freq <=226000)): 
-			band = 1.25 #1.25m
-			mode = "unknown"
-		elif ((freq >=420000) and (freq <=470000)): 
-			band = 0.7 #70cm
-			mode = "unknown"
-		elif ((freq >=902000) and (freq <=928000)): 
-			band = 0.33 #33cm US
-			mode = "unknown"
-		elif ((freq >=1200000) and (freq <=1300000)): 
-			band = 0.23 #23cm
-			mode = "unknown"
-		elif ((freq >=2390000) and (freq <=2450000)): 
-			band = 0.13 #13cm
-			mode = "unknown"
-		elif ((freq >=3300000) and (freq <=3500000)): 
-			band = 0.09 #9cm
-			mode = "unknown"
-		elif ((freq >=5650000) and (freq <=5850000)): 
-			band = 0.053 #5.3cm
-			mode = "unknown"
-		elif ((freq >=10000000) and (freq <=10500000)): 
-			band = 0.03 #3cm
-			mode = "unknown"
-		elif ((freq >=24000000) and (freq <=24050000)): 
-			band = 0.0125 #1,25cm
-			mode = "unknown"
-		elif ((freq >=47000000) and (freq <=47200000)): 
-			band = 0.0063 #6,3mm
-			mode = "unknown"
-		else:
-			band = 0
-			mode = "unknown"
-		return(band, mode)
+		return(Spot.band_plan.lookup(freq))
+
+	@property
+	def path(self):
+		""" (distance in km, bearing in degrees) from the spotter to the DX station, based on the
+		positions of the Country File and the locator of the spotter; None for invalid spots"""
+		if not self.valid:
+			return(None)
+		return(station_path(self.spotter_station, self.dx_station, Station.database.tables, self.locator))
+
+	@property
+	def locator_position(self):
+		"""(latitude, longitude) of the locator of the spotter (self.locator); None if there is none"""
+		return(locator_to_position(self.locator) if self.locator else None)
+
+	@property
+	def locators(self):
+		"""locators and propagation mode of the comment (geo.CommentLocators), e.g. of "JN48QT<ES>IM98" """
+		return(comment_locators(self.comment))
+
+	@property
+	def distance(self):
+		path = self.path
+		return(None if path is None else path[0])
+
+	@property
+	def bearing(self):
+		path = self.path
+		return(None if path is None else path[1])
 		
-	def __process_spot(self, raw_string):
-		"""Chop Line from DX-Cluster into pieces and return a dict with the spot data"""
+	def __process_spot(self, raw_string, fields=None):
+		"""Chop Line from DX-Cluster into pieces; band and mode are looked up by the caller"""
+		if fields is not None: #fast path (split_spot)
+			spotter_call, frequency, dx_call, comment, hour, minute, locator = fields
+			_set(self, 'spotter_call', spotter_call)
+			_set(self, 'frequency', frequency)
+			_set(self, 'dx_call', dx_call)
+			_set(self, 'comment', comment)
+			_set(self, 'time', Spot.timestamps.resolve(hour, minute))
+			_set(self, 'locator', locator)
+			return(True)
+		field = "spotter_call" #field being decoded; the reason in metrics.errors if it fails
 		try:
-			spotter_call_temp = re.match('[A-Za-z0-9\/]+[:$]', raw_string[6:15])
+			spotter_call_temp = RE_SPOTTER_CALL.match(raw_string[6:15])
 			if spotter_call_temp:
-				self.spotter_call = re.sub(':', '', spotter_call_temp.group(0))
+				_set(self, 'spotter_call', spotter_call_temp.group(0).replace(':', ''))
 			else:
-				self._logger.debug("Missing Semicolon ?!")
-				self.spotter_call = re.sub('[^A-Za-z0-9\/]+', '', raw_string[6:15])
-
-			frequency_temp = re.search('[0-9\.]{5,12}', raw_string[10:25])
+				logger.debug("Missing Semicolon ?!")
+				metrics.fallbacks.inc("missing_colon")
+				_set(self, 'spotter_call', RE_NON_CALL_CHARS.sub('', raw_string[6:15]))
+			field = "frequency"
+			frequency_temp = RE_FREQUENCY.search(raw_string[10:25])
 			if frequency_temp: 
-				self.frequency = float(frequency_temp.group(0))
+				_set(self, 'frequency', float(frequency_temp.group(0)))
 			else:
-				self._logger.debug("RegEx for Frequency didn't work")
-				self.frequency = float(re.sub('[^0-9\.]+', '', raw_string[16:25]))
-				self._logger.error("__process_spot(): Frequency incorrect; "+frequency_temp)
+				logger.debug("RegEx for Frequency didn't work")
+				metrics.fallbacks.inc("frequency_regex")
+				_set(self, 'frequency', float(RE_NON_FREQUENCY_CHARS.sub('', raw_string[16:25])))
+				logger.error("__process_spot(): Frequency incorrect; %s", raw_string[16:25])
 				raise Exception("Could not decode frequency")
 
-			self.dx_call = re.sub('[^A-Za-z0-9\/]+', '', raw_string[26:38])
-			self.comment = re.sub('[^\sA-Za-z0-9\.,;\#\+\-!\?\$\(\)@\/]+', ' ', raw_string[39:69])
-			time_temp = re.sub('[^0-9]+', '', raw_string[70:74])
-			self.time = datetime.utcnow().replace(hour=int(time_temp[0:2]), minute=int(time_temp[2:4]), second=0, microsecond = 0, tzinfo=UTC)
-			self.locator = re.sub('[^A-Za-z0-9]+', '', raw_string[75:80])
-			self.band, self.mode = self.convert_freq_to_band(self.frequency)
+			field = "dx_call"
+			_set(self, 'dx_call', RE_NON_CALL_CHARS.sub('', raw_string[26:38]))
+			field = "comment"
+			_set(self, 'comment', RE_NON_SPOT_COMMENT_CHARS.sub(' ', raw_string[39:69]))
+			field = "time"
+			time_temp = RE_NON_DIGITS.sub('', raw_string[70:74])
+			_set(self, 'time', Spot.timestamps.resolve(int(time_temp[0:2]), int(time_temp[2:4])))
+			field = "locator"
+			_set(self, 'locator', RE_NON_ALNUM.sub('', raw_string[75:80]))
 			return(True)
 		except Exception as e:
-			self._logger.error(str(e)) 
-			self._logger.exception("Problem in Spot Processing")
+			logger.exception("Problem in Spot Processing: %s", e)
+			metrics.errors.inc(("spot", field))
 			return(False)
 			
 
 class WWV(object):
-	
+	__slots__ = ('station', 'time', 'a', 'sfi', 'k', 'expk', 'r', 'aurora', 'valid', 'counter')
+	__setattr__ = _immutable
+	__getstate__ = _getstate
+	__setstate__ = _setstate
+
 	#------------------Constructor --------------------
 	def __init__(self, raw_wwv):
 	#	super(Station, self).__init__()
-		self._logger = get_configured_logger(root_logger)
-		self._logger.propagate = True #send all log events to higher logger which has a handler
-		self.station = None
-		self.time = None
-		self.a = None
-		self.sfi = None
-		self.k = None
-		self.expk = None
-		self.r = None
-		self.aurora = False
-		self.valid = False
-		self.counter = 0
+		_set(self, 'station', None)
+		_set(self, 'time', None)
+		_set(self, 'a', None)
+		_set(self, 'sfi', None)
+		_set(self, 'k', None)
+		_set(self, 'expk', None)
+		_set(self, 'r', None)
+		_set(self, 'aurora', False)
+		_set(self, 'valid', False)
+		_set(self, 'counter', 0)
 		if self.__process_wwv(raw_wwv):
-			self.valid = True
-		
+			_set(self, 'valid', True)
+		metrics.records.inc(("wwv", "valid" if self.valid else "invalid"))
 	def __process_wwv(self, wwv):
 		"""Chop Line from DX-Cluster into pieces and return WWV data"""
+		field = "type" #field being decoded; the reason in metrics.errors if it fails
 		try:
-			if re.match('^WWV', wwv) or re.search('^WCY', wwv):
-				if re.search('\s[\-A-Z0-9/]{3,10}\s', wwv[6:20], re.I):
-					station =  re.search('\s[\-A-Z0-9/]{3,10}\s', wwv[6:20], re.I).group(0)
-					station = station.lstrip().rstrip()
+			if wwv.startswith(('WWV', 'WCY')):
+				field = "station"
+				station = RE_WWV_STATION.search(wwv[6:20])
+				if station:
+					station = station.group(0).lstrip().rstrip()
 					station = Station(station)
 					if station:
-						self.station = station
+						_set(self, 'station', station)
 					else:
 						raise Exception("Callsign wrong")
 						
-				if re.search('<[\d]{2}>', wwv):
-					time_temp = re.search('<[\d]{2}>', wwv).group(0)
-					time_temp = re.search('[\d]{2}', time_temp).group(0)
-					time_temp = int(time_temp)
-					self.time = datetime.utcnow().replace(hour=time_temp, minute=0, second=0, microsecond=0, tzinfo=UTC)
-
-				if re.search('A=\d{1,3}', wwv):
-					temp = re.search('A=\d{1,3}', wwv).group(0)
-					temp = re.sub('A=', '', temp)
-					self.a = int(temp)
+				field = "time"
+				time_temp = RE_WWV_HOUR.search(wwv)
+				if time_temp:
+					time_temp = int(time_temp.group(1))
+					_set(self, 'time', Spot.timestamps.resolve(time_temp)) #same resolver, so spots and WWV lines of an archive are dated in one sequence
+				field = "a"
+				temp = RE_WWV_A.search(wwv)
+				if temp:
+					_set(self, 'a', int(temp.group(1)))
 				else:
 					raise Exception("could not decode A")
 					
-				if re.search('SFI=\d{1,3}', wwv):
-					temp = re.search('SFI=\d{1,3}', wwv).group(0)
-					temp = re.sub('SFI=', '', temp)
-					self.sfi = int(temp)
+				field = "sfi"
+				temp = RE_WWV_SFI.search(wwv)
+				if temp:
+					_set(self, 'sfi', int(temp.group(1)))
 				else:
 					raise Exception("could not decode SFI")
 					
-				if re.search('\sK=\d{1,3}', wwv):
-					temp = re.search('\sK=\d{1,3}', wwv).group(0)
-					temp = re.sub('\sK=', '', temp)
-					self.k = int(temp)
+				field = "k"
+				temp = RE_WWV_K.search(wwv)
+				if temp:
+					_set(self, 'k', int(temp.group(1)))
 				else:
 					raise Exception("could not decode K")
 
-				if re.search('expK=\d{1,3}', wwv):
-					temp = re.search('expK=\d{1,3}', wwv).group(0)
-					temp = re.sub('expK=', '', temp)
-					self.expk = int(temp)
-					
-				if re.search('R=\d{1,3}', wwv):
-					temp = re.search('R=\d{1,3}', wwv).group(0)
-					temp = re.sub('R=', '', temp)
-					self.r = int(temp)
-					
-				if re.search('Au=\S{2,3}', wwv):
-					temp = re.search('Au=\S{2,3}', wwv).group(0)
-					temp = re.sub('Au=', '', temp)
+				temp = RE_WWV_EXPK.search(wwv)
+				if temp:
+					_set(self, 'expk', int(temp.group(1)))
+				temp = RE_WWV_R.search(wwv)
+				if temp:
+					_set(self, 'r', int(temp.group(1)))
+				temp = RE_WWV_AURORA.search(wwv)
+				if temp:
+					temp = temp.group(1)
 					if temp == "no":
-						self.aurora = False
+						_set(self, 'aurora', False)
 					elif temp == "yes":
-						self.aurora = True
-				
-				self._logger.info("Stored WWV successfully")
-				self._logger.info(self.station.call + " " + self.time.strftime("%d.%m.%Y %H:%M:%S") + " A:" + str(self.a) + " SFI:" + str(self.sfi) + " K:" + str(self.k) + " expK:" + str(self.expk) + " R:" + str(self.r) + " Aurora:" + str(self.aurora))
+						_set(self, 'aurora', True)
+				if self.station is None:
+					field = "station"
+					raise Exception("could not decode station")
+				if self.time is None:
+					field = "time"
+					raise Exception("could not decode time")
+				if logger.isEnabledFor(logging.INFO):
+					logger.info("Stored WWV successfully: %s %s A:%s SFI:%s K:%s expK:%s R:%s Aurora:%s", self.station.call,
+						self.time.strftime("%d.%m.%Y %H:%M:%S"), self.a, self.sfi, self.k, self.expk, self.r, self.aurora)
 				return(True)
 			else:
 				raise Exception("missing starting letters 'WWV'")
 		except Exception as e:
-			self._logger.error(str(e)) 
-			self._logger.error("Problem in WWV Processing")
+			logger.error("Problem in WWV Processing: %s", e)
+			metrics.errors.inc(("wwv", field))
 			return(False)
 
 
 
 class Comment(object):
+	__slots__ = ('station', 'time', 'text', 'valid')
+	__setattr__ = _immutable
+	__getstate__ = _getstate
+	__setstate__ = _setstate
+
 	#------------------Constructor --------------------
 	def __init__(self, raw_comment):
 	#	super(Station, self).__init__()
-		self._logger = get_configured_logger(root_logger)
-		self._logger.propagate = True #send all log events to higher logger which has a handler
-
-		self.station = None
-		self.time = None
-		self.text = None
-		self.valid = False
+		_set(self, 'station', None)
+		_set(self, 'time', None)
+		_set(self, 'text', None)
+		_set(self, 'valid', False)
 		if self.__process_comment(raw_comment):
-			self.valid = True
-	
+			_set(self, 'valid', True)
+		metrics.records.inc(("comment", "valid" if self.valid else "invalid"))
 	def __process_comment(self, comment):
 		"""Chop Line from DX-Cluster into pieces and return Comment data"""
+		field = "type" #field being decoded; the reason in metrics.errors if it fails
 		try:
-			if re.match('^To ALL de', comment, re.I):
-				if re.search('de [\-A-Z0-9/]{4,15}', comment[6:20], re.I):
-					station = re.search('de [\-A-Z0-9/]{4,15}', comment[6:20], re.I).group(0)
-					station = re.sub('de ','', station)
+			if RE_TO_ALL.match(comment):
+				field = "station"
+				station = RE_COMMENT_STATION.search(comment[6:20])
+				if station:
+					station = station.group(0).replace('de ', '')
 					station = station.upper()
-					self.station = Station(station)
+					_set(self, 'station', Station(station))
 					if not self.station.valid:
 						raise Exception("Callsign invalid")
 				else:
 					raise Exception("Callsign invalid")
 
-				self.time = datetime.utcnow().replace(tzinfo = UTC)
-				self.text = "hi"
-				if re.search(':[\S\s]+', comment):
-					text = re.search(':[\S\s]+', comment).group(0)
-					text = re.sub(': ', '', text)
-					text = re.sub('[^A-Za-z0-9\.,@&\?;\-\#\+!\$\(\)\/]+', ' ', text) #sanitize input
+				field = "text"
+				_set(self, 'time', datetime.utcnow().replace(tzinfo = UTC))
+				_set(self, 'text', "hi")
+				text = RE_COMMENT_TEXT.search(comment)
+				if text:
+					text = text.group(0).replace(': ', '')
+					text = RE_NON_COMMENT_CHARS.sub(' ', text) #sanitize input
 					text = text.rstrip() #chop off tailing whitespaces
-					self.text = text
+					_set(self, 'text', text)
 				else:
 					raise Exception("Comment text not processible; Missing semicolon?")
 				
-				self._logger.debug("Comment successfully processed")
-				self._logger.debug(self.station.call + " " + self.time.strftime("%d.%m.%Y %H:%M:%S") + " " + self.text)
+				if logger.isEnabledFor(logging.DEBUG):
+					logger.debug("Comment successfully processed: %s %s %s", self.station.call, self.time.strftime("%d.%m.%Y %H:%M:%S"), self.text)
 				return(True)
 				
 			else:
 				raise Exception("missing starting letters 'TO ALL'")
 		
 		except Exception as e:
-			self._logger.error(str(e))
-			self._logger.error("Problem in Comment Processing")
-			return(False)
\ No newline at end of file
+			logger.error("Problem in Comment Processing: %s", e)
+			metrics.errors.inc(("comment", field))
+			return(False)
+
+
+#------------------Line Dispatch --------------------
+LINE_TYPES = { #first three letters of a line (upper case) -> class which decodes it
+	"DX ": Spot,
+	"WWV": WWV,
+	"WCY": WWV,
+	"TO ": Comment
+}
+
+def parse_line(line):
+	""" Decode a line from the DX-Cluster (str, bytes or memoryview) into a Spot, WWV or
+	Comment object; None for any other line. bytes are only decoded to str for lines of a
+	known type"""
+	if line.__class__ is memoryview:
+		line = line.tobytes()
+	if bytes is not str and isinstance(line, (bytes, bytearray)):
+		line = line.rstrip(b"\r\n")
+		cls = LINE_TYPES.get(line[:3].upper().decode("ascii", "replace"))
+		if cls is None:
+			metrics.records.inc(("other", "ignored"))
+			return(None)
+		if cls is not Spot:
+			line = line.decode("ascii", "replace")
+		return(cls(line))
+	line = line.rstrip("\r\n")
+	cls = LINE_TYPES.get(line[:3].upper())
+	if cls is None:
+		metrics.records.inc(("other", "ignored"))
+		return(None)
+	return(cls(line))
+
+def parse_lines(lines, skip_invalid=False):
+	""" Generator which decodes lines (e.g. an open file or socket) one by one and yields
+	Spot, WWV and Comment objects. Lines of any other type are skipped, as are invalid
+	objects if skip_invalid is set"""
+	for line in lines:
+		record = parse_line(line)
+		if record is None:
+			continue
+		if skip_invalid and not record.valid:
+			continue
+		yield record
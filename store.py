@@ -0,0 +1,139 @@
+#!/usr/bin/python
+# Filename: store.py
+
+# In-memory store of the latest spots with secondary indexes for queries like
+# "20m CW spots of EU spotters in CQ zone 14 within the last 15 minutes".
+
+from datetime import timedelta
+
+#------------------CONSTANTS --------------------
+CAPACITY = 100000 #spots; the oldest spot is dropped when a new one arrives in a full store
+INDEXES = ("band", "mode", "dx_call", "dx_country", "dx_continent", "dx_cqz", "dx_ituz",
+	"spotter_country", "spotter_continent", "spotter_cqz", "spotter_ituz") #criteria of SpotStore.query()
+
+def index_values(spot):
+	"""values of a spot for the INDEXES (in the same order)"""
+	dx = spot.dx_station
+	spotter = spot.spotter_station
+	return((spot.band, spot.mode, spot.dx_call, dx.country, dx.continent, dx.cqz, dx.ituz,
+		spotter.country, spotter.continent, spotter.cqz, spotter.ituz))
+
+class SpotStore(object):
+	""" Keeps the latest capacity spots in a ring buffer (and optionally only those which are
+	no older than max_age seconds). Every spot gets a sequence number; the indexes map the
+	values of the criteria in INDEXES to sets of sequence numbers, so a query intersects the
+	sets of its criteria starting with the smallest one and doesn't scan the store. Time
+	queries use a binary search, the spots are expected in about chronological order"""
+
+	def __init__(self, capacity=CAPACITY, max_age=None):
+		self.capacity = capacity
+		self.max_age = None if max_age is None else timedelta(seconds=max_age)
+		self.indexes = dict((name, {}) for name in INDEXES)
+		self._indexes = [self.indexes[name] for name in INDEXES]
+		self._spots = [None] * capacity #ring buffers, sequence number % capacity
+		self._times = [None] * capacity
+		self._keys = [None] * capacity #index values of a spot, needed to remove it from the indexes
+		self._first = 0 #sequence number of the oldest spot
+		self._next = 0 #sequence number of the next spot
+
+	def __len__(self):
+		return(self._next - self._first)
+
+	def __iter__(self):
+		"""spots from the oldest to the latest"""
+		return(iter([self._spots[seq % self.capacity] for seq in range(self._first, self._next)]))
+
+	def add(self, spot):
+		"""store a valid spot; returns its sequence number (None for invalid spots)"""
+		if not spot.valid:
+			return(None)
+		if self._next - self._first >= self.capacity:
+			self._drop()
+		seq = self._next
+		slot = seq % self.capacity
+		keys = index_values(spot)
+		for index, key in zip(self._indexes, keys):
+			seqs = index.get(key)
+			if seqs is None:
+				seqs = index[key] = set()
+			seqs.add(seq)
+		self._spots[slot] = spot
+		self._times[slot] = spot.time
+		self._keys[slot] = keys
+		self._next = seq + 1
+		if self.max_age is not None:
+			self.expire(spot.time - self.max_age)
+		return(seq)
+
+	def expire(self, before):
+		"""drop all spots older than before (datetime)"""
+		while self._first < self._next and self._times[self._first % self.capacity] < before:
+			self._drop()
+
+	def _drop(self):
+		seq = self._first
+		slot = seq % self.capacity
+		for index, key in zip(self._indexes, self._keys[slot]):
+			seqs = index[key]
+			seqs.discard(seq)
+			if not seqs:
+				del index[key]
+		self._spots[slot] = self._times[slot] = self._keys[slot] = None
+		self._first = seq + 1
+
+	def _since(self, since):
+		"""sequence number of the first spot at or after since"""
+		lo, hi = self._first, self._next
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if self._times[mid % self.capacity] < since:
+				lo = mid + 1
+			else:
+				hi = mid
+		return(lo)
+
+	def latest(self):
+		"""the latest spot; None if the store is empty"""
+		return(self._spots[(self._next - 1) % self.capacity] if self._next > self._first else None)
+
+	def query(self, since=None, limit=None, **criteria):
+		""" Spots which match all criteria (names of INDEXES, e.g. band=20, mode="CW",
+		spotter_continent="EU"), the latest first. A criterion can be a tuple, list or set
+		of values which matches any of them. since is a datetime or a timedelta (before
+		the latest spot). At most limit spots are returned"""
+		first = self._first
+		if since is not None and self._next > first:
+			if isinstance(since, timedelta):
+				since = self._times[(self._next - 1) % self.capacity] - since
+			first = self._since(since)
+		candidates = []
+		for name, value in criteria.items():
+			index = self.indexes.get(name)
+			if index is None:
+				raise ValueError("unknown criterion: " + name)
+			if isinstance(value, (tuple, list, set, frozenset)):
+				seqs = set()
+				for key in value:
+					seqs.update(index.get(key, ()))
+			else:
+				seqs = index.get(value)
+				if seqs is None:
+					return([])
+			candidates.append(seqs)
+		if not candidates:
+			seqs = range(first, self._next)
+		else:
+			candidates.sort(key=len)
+			if self._next - first < len(candidates[0]): #the time range is more selective than any index
+				seqs = [seq for seq in range(first, self._next) if all(seq in c for c in candidates)]
+			else:
+				seqs = candidates[0].intersection(*candidates[1:]) if len(candidates) > 1 else candidates[0]
+				seqs = [seq for seq in seqs if seq >= first]
+		seqs = sorted(seqs, reverse=True)[:limit]
+		return([self._spots[seq % self.capacity] for seq in seqs])
+
+	def count(self, name):
+		"""number of stored spots per value of an index, e.g. count("band")"""
+		return(dict((key, len(seqs)) for key, seqs in self.indexes[name].items()))
+
+# End of store.py
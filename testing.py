@@ -25,19 +25,73 @@
 
 import sys
 import re
+import math
 import pytz
 from pytz import timezone
-from datetime import datetime, time, date, tzinfo
+from datetime import datetime, time, date, tzinfo, timedelta
 import time
 import logging
 from logging import StreamHandler
 import atexit
+import os
+import shutil
+import tempfile
 import unittest
-from spot_processing import Station, Spot, WWV, Comment
+import copy
+import pickle
+try:
+	import numpy
+except ImportError:
+	numpy = None
+try:
+	import asyncio
+	from cluster import ClusterConnection
+except (ImportError, SyntaxError): #Python 2
+	asyncio = None
+try:
+	import bulk
+except ImportError: #concurrent.futures is missing in Python 2
+	bulk = None
+try:
+	import columnar
+except ImportError: #NumPy is not installed
+	columnar = None
+from spot_processing import Station, Spot, WWV, Comment, parse_line, parse_lines, split_spot
+from cty import load_cty, compile_cty, load_snapshot, build_indexes, diff_cty, PrefixIndex, CountryDatabase, CtyEntry
+from cache import LRUCache
+from bandplan import load_band_plan, BandPlan
+from timestamps import TimestampResolver, MAX_CLOCK_SKEW
+from aggregation import SpotAggregator
+from store import SpotStore
+from geo import great_circle, locator_to_position, path_matrix, comment_locators, locator_cache, EARTH_RADIUS
+import metrics
+from metrics import Metrics
+import profiling
 UTC = pytz.utc
 
 rootlogger = "dxcsucker"
 
+def last_utc(hour, minute=0):
+	"""the latest hour:minute UTC which isn't ahead of now by more than MAX_CLOCK_SKEW (see TimestampResolver)"""
+	now = datetime.utcnow().replace(tzinfo=UTC)
+	stamp = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+	if stamp > now + timedelta(seconds=MAX_CLOCK_SKEW):
+		stamp -= timedelta(days=1)
+	return(stamp)
+
+SPOT_LINE = "DX de %-9s%9.1f  %-12s %-30s %04dZ"
+
+def make_spots(rows, day):
+	""" Decode the rows of an archive which starts on day (date). A row is a line (decoded with
+	parse_line, so it can also be a WWV line) or a tuple (spotter call with colon, frequency,
+	dx call, hhmm) for a spot line without comment"""
+	timestamps = Spot.timestamps
+	try:
+		Spot.timestamps = TimestampResolver(date=day)
+		return([parse_line(row) if isinstance(row, str) else Spot(SPOT_LINE % (row[0], row[1], row[2], "", row[3])) for row in rows])
+	finally:
+		Spot.timestamps = timestamps
+
 #Define a root logger which is needed for spot_processing Classes
 def get_logger(name):
 	logger = logging.getLogger(name)
@@ -52,7 +106,7 @@ logger = get_logger(rootlogger)
 
 fixture_spot1 = "DX de CT3FW:     21004.8  HC2AO        599 TKS(CW)QSL READ,QRZ.COM    2132Z"
 
-fixture_spot1_time = datetime.utcnow().replace( hour=21, minute=32, second=0, microsecond = 0, tzinfo=UTC)
+fixture_spot1_time = last_utc(21, 32)
 
 fixture_spot2 = "DX de DL6NAA: 10368887.0  DL7VTX/B     55s in JO50VFjo62 never hrd B4 1505Z"
 fixture_spot3 = "DX de CT3FW:     21004.8  IDIOT        599 TKS(CW)QSL READ,QRZ.COM    2132Z"
@@ -93,6 +147,49 @@ fixture_comment_invalid_3 = "TO ALL de DL5ML to DX0HQ pse lsn for EU        "
 fixture_comment_invalid_4 = "TO ALL de: to DX0HQ pse lsn for EU        "
 
 
+if asyncio:
+	class FakeClusterProtocol(asyncio.Protocol):
+		"""Fake DX Cluster (telnet) which asks for the login and sends the lines of its
+		session in small pieces; the connection is closed after the last session"""
+		def __init__(self, server):
+			self.server = server
+
+		def connection_made(self, transport):
+			self.transport = transport
+			self.session = self.server.sessions.pop(0) if self.server.sessions else None
+			transport.write(b"\xff\xfb\x01Welcome to the fake cluster\r\nlogin: ") #IAC WILL ECHO
+
+		def data_received(self, data):
+			self.server.received.append(data)
+			if self.session is None:
+				self.transport.close()
+				return
+			payload = b"".join(line if isinstance(line, bytes) else (line + "\r\n").encode("ascii") for line in self.session)
+			chunks = [payload[i:i + 7] for i in range(0, len(payload), 7)] #split lines across packets
+			if not self.server.delay:
+				for chunk in chunks:
+					self.transport.write(chunk)
+				self.transport.close()
+				return
+			loop = asyncio.get_event_loop() #one read per packet
+			for i, chunk in enumerate(chunks):
+				loop.call_later(i * self.server.delay, self.transport.write, chunk)
+			loop.call_later(len(chunks) * self.server.delay, self.transport.close)
+
+	class FakeCluster(object):
+		def __init__(self, sessions, delay=0):
+			self.sessions = list(sessions) #lines (str) or raw bytes
+			self.delay = delay #seconds between the packets
+			self.received = []
+
+		def start(self, loop):
+			self.server = loop.run_until_complete(loop.create_server(lambda: FakeClusterProtocol(self), "127.0.0.1", 0))
+			return(self.server.sockets[0].getsockname()[1])
+
+		def stop(self, loop):
+			self.server.close()
+			loop.run_until_complete(self.server.wait_closed())
+
 
 class TestSequenceFunctions(unittest.TestCase):
 	
@@ -130,7 +227,7 @@ class TestSequenceFunctions(unittest.TestCase):
 	
 	def test_wwv_all_properties_fixture_1(self):
 		self.assertEqual(WWV(fixture_wwv1).station.call, "VE7CC")
-		test_time = datetime.utcnow().replace(hour=9, minute=0, second=0, microsecond=0, tzinfo=UTC)
+		test_time = last_utc(9)
 		self.assertEqual(WWV(fixture_wwv1).time, test_time)
 		self.assertEqual(WWV(fixture_wwv1).a, 18)
 		self.assertEqual(WWV(fixture_wwv1).k, 2)
@@ -142,7 +239,7 @@ class TestSequenceFunctions(unittest.TestCase):
 		
 	def test_wwv_all_properties_fixture_5(self):
 		self.assertEqual(WWV(fixture_wwv5).station.call, "W0MU")
-		test_time = datetime.utcnow().replace(hour=21, minute=0, second=0, microsecond=0, tzinfo=UTC)
+		test_time = last_utc(21)
 		self.assertEqual(WWV(fixture_wwv5).time, test_time)
 		self.assertEqual(WWV(fixture_wwv5).a, 8)
 		self.assertEqual(WWV(fixture_wwv5).k, 2)
@@ -154,7 +251,7 @@ class TestSequenceFunctions(unittest.TestCase):
 
 	def test_wwv_all_properties_fixture_11(self):
 		self.assertEqual(WWV(fixture_wwv11).station.call, "DK0WCY-2")
-		test_time = datetime.utcnow().replace(hour=20, minute=0, second=0, microsecond=0, tzinfo=UTC)
+		test_time = last_utc(20)
 		self.assertEqual(WWV(fixture_wwv11).time, test_time)
 		self.assertEqual(WWV(fixture_wwv11).a, 23)
 		self.assertEqual(WWV(fixture_wwv11).k, 3)
@@ -166,7 +263,7 @@ class TestSequenceFunctions(unittest.TestCase):
 
 	def test_wwv_aurora_fixture_12(self):
 		self.assertEqual(WWV(fixture_wwv12).station.call, "DK0WCY-10")
-		test_time = datetime.utcnow().replace(hour=20, minute=0, second=0, microsecond=0, tzinfo=UTC)
+		test_time = last_utc(20)
 		self.assertEqual(WWV(fixture_wwv12).aurora, True)
 		self.assertEqual(WWV(fixture_wwv12).valid, True)
 
@@ -353,6 +450,61 @@ class TestSequenceFunctions(unittest.TestCase):
 		self.assertEqual(Spot(fixture_spot1).time, fixture_spot1_time)
 		self.assertEqual(Spot(fixture_spot1).band, 15)
 	
+	def test_split_spot_fast_path(self):
+		for line in (fixture_spot1, fixture_spot2, fixture_spot4, fixture_spot5, fixture_spot6):
+			fields = split_spot(line)
+			self.assertEqual(split_spot(line.encode("ascii")), fields)
+			self.assertEqual(split_spot(memoryview(line.encode("ascii"))), fields)
+			fast_path = Spot.fast_path
+			try:
+				Spot.fast_path = False
+				spot = Spot(line)
+			finally:
+				Spot.fast_path = fast_path
+			self.assertEqual(fields, (spot.spotter_call, spot.frequency, spot.dx_call, spot.comment,
+				spot.time.hour, spot.time.minute, spot.locator))
+		self.assertEqual(split_spot(fixture_spot7), None) #no colon, left to the regular expressions
+		self.assertEqual(split_spot(fixture_spot1[:72]), None) #truncated time
+		slots = [name for name in Spot.__slots__ if not name.endswith("_station")]
+		for line in (fixture_spot1, fixture_spot2, fixture_spot3, fixture_spot4, fixture_spot5, fixture_spot6, fixture_spot7,
+			fixture_spot8, fixture_spot9, fixture_spot10, fixture_spot11, fixture_spot12, fixture_spot1[:72], fixture_spot4 + "\r\n",
+			fixture_spot1.replace("TKS", "T>S"), fixture_spot4.replace("JO70", "J 70")):
+			spots = []
+			for enabled in (False, True):
+				Spot.fast_path = enabled
+				try:
+					spots.append([getattr(Spot(line), name) for name in slots])
+				finally:
+					Spot.fast_path = fast_path
+			self.assertEqual(spots[0], spots[1]) #same fields with and without the fast path
+		self.assertEqual(Spot(fixture_spot1.encode("ascii")).dx_call, "HC2AO")
+
+	def test_timestamp_resolver_live(self):
+		now = [datetime(2014, 1, 25, 0, 1, 30, tzinfo=UTC)]
+		resolver = TimestampResolver(clock=lambda: (now[0] - datetime(1970, 1, 1, tzinfo=UTC)).total_seconds())
+		self.assertEqual(resolver.resolve(0, 1), datetime(2014, 1, 25, 0, 1, tzinfo=UTC))
+		self.assertEqual(resolver.resolve(0, 5), datetime(2014, 1, 25, 0, 5, tzinfo=UTC)) #within MAX_CLOCK_SKEW
+		self.assertEqual(resolver.resolve(23, 59), datetime(2014, 1, 24, 23, 59, tzinfo=UTC)) #spotted before midnight
+		self.assertEqual(resolver.resolve(0, 1) is resolver.resolve(0, 1), True)
+		now[0] = datetime(2014, 1, 26, 12, 0, tzinfo=UTC)
+		self.assertEqual(resolver.resolve(11, 0), datetime(2014, 1, 26, 11, 0, tzinfo=UTC))
+		self.assertEqual(resolver.day, date(2014, 1, 26))
+		self.assertRaises(ValueError, resolver.resolve, 24, 0)
+		self.assertRaises(ValueError, resolver.resolve, 12, 75)
+
+	def test_timestamp_resolver_archive(self):
+		resolver = TimestampResolver(date=date(2014, 1, 25))
+		times = [(23, 58), (23, 59), (0, 1), (23, 59), (0, 2), (12, 0), (0, 3)]
+		self.assertEqual([resolver.resolve(hour, minute) for hour, minute in times], [
+			datetime(2014, 1, 25, 23, 58, tzinfo=UTC), datetime(2014, 1, 25, 23, 59, tzinfo=UTC),
+			datetime(2014, 1, 26, 0, 1, tzinfo=UTC), datetime(2014, 1, 25, 23, 59, tzinfo=UTC), #late spot
+			datetime(2014, 1, 26, 0, 2, tzinfo=UTC), datetime(2014, 1, 26, 12, 0, tzinfo=UTC),
+			datetime(2014, 1, 26, 0, 3, tzinfo=UTC)])
+		records = make_spots([fixture_spot1, fixture_spot2, fixture_wwv11], date(2014, 1, 25))
+		self.assertEqual([record.time for record in records], [datetime(2014, 1, 25, 21, 32, tzinfo=UTC),
+			datetime(2014, 1, 25, 15, 5, tzinfo=UTC), #less than ROLLOVER back in time
+			datetime(2014, 1, 25, 20, 0, tzinfo=UTC)]) #WWV uses Spot.timestamps too
+
 	def test_station_beacon_flag(self):
 		self.assertEqual(Station("DH1TW/BCN").beacon, True)
 		self.assertEqual(Station("DH1TW/BCN").valid, True)
@@ -382,6 +534,501 @@ class TestSequenceFunctions(unittest.TestCase):
 		self.assertEqual(Station("R7GA/MM").prefix, False)
 		self.assertEqual(Station("R7GA/MM").mm, True)
 
+	def test_cty_snapshot_matches_plist(self):
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			snapshot = compile_cty("cty.plist", os.path.join(tmp_dir, "cty.bin"))
+			self.assertEqual(load_snapshot(snapshot), Station.dxcc)
+			self.assertEqual(load_cty("cty.plist", snapshot), Station.dxcc)
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_cty_stale_snapshot_is_ignored(self):
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			snapshot = compile_cty("cty.plist", os.path.join(tmp_dir, "cty.bin"))
+			self.assertEqual(load_snapshot(snapshot, b"\0" * 20), False)
+			with open(snapshot, "wb") as f:
+				f.write(b"broken")
+			self.assertEqual(load_cty("cty.plist", snapshot), Station.dxcc)
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_prefix_index_longest_match(self):
+		index = PrefixIndex(["D", "DL", "DL1A", "VP2E"])
+		self.assertEqual(len(index), 4)
+		self.assertEqual(index.longest_prefix("DL1ABC"), "DL1A")
+		self.assertEqual(index.longest_prefix("DL2ABC"), "DL")
+		self.assertEqual(index.longest_prefix("DH1TW"), "D")
+		self.assertEqual(index.longest_prefix("VP2M"), "")
+		self.assertEqual(index.longest_prefix("DL 1ABC"), "DL1A")
+		self.assertEqual(index.longest_prefix(""), "")
+		self.assertEqual("DL1A" in index, True)
+		self.assertEqual("DL1" in index, False)
+
+	def test_exact_callsigns(self):
+		exact_calls, index = build_indexes({"K": Station.dxcc["K"], "K6SXA": Station.dxcc["K6SXA"], "3Y": Station.dxcc["3Y"]})
+		self.assertEqual(exact_calls, frozenset(["K6SXA"]))
+		self.assertEqual(index.longest_prefix("K6SXAB"), "K")
+		self.assertEqual(Station("K6SXA").prefix, "K6SXA")
+		self.assertEqual(Station("K6SXA").resolved_by, "exact")
+		self.assertEqual(Station("K6SXA").country, "United States")
+		self.assertEqual(Station("LU1DVE/D").resolved_by, "exact")
+		self.assertEqual(Station("LU1DVE/D").country, "Argentina")
+		self.assertEqual(Station("3Y0E").country, "Bouvet")
+		self.assertEqual(Station("3Y0EA").country, "Antarctica") #3Y0E is not a prefix
+		self.assertEqual(Station("3Y0EA").resolved_by, "prefix")
+		self.assertEqual(Station("DH1TW").resolved_by, "prefix")
+		self.assertEqual(Station("DH1TW/MM").resolved_by, None)
+
+	def test_entity_table(self):
+		tables = Station.database.tables
+		self.assertEqual(tables.lookup("DH") is tables.lookup("DL"), True) #one record per entity
+		self.assertEqual(tables.entity_ids["W6"], tables.entity_ids["K"])
+		self.assertEqual(tables.lookup("K").cqz, 5)
+		self.assertEqual(tables.lookup("W6").cqz, 3) #zone override
+		self.assertEqual(tables.lookup("W6").country, "United States")
+		self.assertEqual(tables.lookup("QQQ"), None)
+		self.assertEqual(Station.dxcc["DH"] is Station.dxcc["DL"], True) #equal entries are shared
+		station = Station("DH1TW")
+		self.assertEqual(station.lookup_cty_info("DL") is station.cty_info, True)
+		self.assertEqual(station.lookup_cty_info("QQQ"), False)
+
+	def test_lru_cache_counters(self):
+		cache = LRUCache(2)
+		cache.put("DH1TW", 1)
+		cache.put("HC2AO", 2)
+		self.assertEqual(cache.get("DH1TW"), 1)
+		cache.put("VP5DX", 3) #evicts HC2AO, the least recently used entry
+		self.assertEqual(cache.get("HC2AO"), None)
+		self.assertEqual(cache.get("VP5DX"), 3)
+		self.assertEqual(cache.stats(), {'size': 2, 'maxsize': 2, 'hits': 2, 'misses': 1, 'evictions': 1})
+
+	def test_station_cache(self):
+		Station.cache.clear()
+		hits = Station.cache.hits
+		self.assertEqual(Station("EA4/DH1TW/M").country, Station("EA4/DH1TW/M").country)
+		self.assertEqual(Station.cache.hits, hits + 1)
+		self.assertEqual(Station("EA4/DH1TW/M").prefix, "EA")
+		self.assertEqual(Station("DH1TW/MM").mm, True)
+		self.assertEqual(Station("DH1TW/MM").valid, False)
+		Station.reload_cty("cty.plist")
+		self.assertEqual(len(Station.cache), 0)
+		self.assertEqual(Station("EA4/DH1TW/M").valid, True)
+
+	def test_country_database_reload(self):
+		def write_plist(filename, dxcc):
+			import plistlib
+			if hasattr(plistlib, "dump"):
+				with open(filename, "wb") as f:
+					plistlib.dump(dxcc, f)
+			else: #Python 2
+				plistlib.writePlist(dxcc, filename)
+		entry = {'Country': 'Fed. Rep. of Germany', 'CQZone': 14, 'ITUZone': 28, 'Continent': 'EU',
+			'Latitude': 51.0, 'Longitude': -10.0, 'GMTOffset': -1.0, 'ExactCallsign': False}
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			filename = os.path.join(tmp_dir, "cty.plist")
+			write_plist(filename, {"DL": entry})
+			database = CountryDatabase(filename)
+			swaps = []
+			database.add_listener(lambda old, new: swaps.append((old, new)))
+			old_tables = database.tables
+			self.assertEqual(database.changed(), False)
+			os.utime(filename, (1, 1)) #touched, but not modified
+			self.assertEqual(database.check(), False)
+			write_plist(filename, {"DL": entry, "DH": entry})
+			self.assertEqual(database.check(), True)
+			self.assertEqual(swaps, [(old_tables, database.tables)])
+			self.assertEqual(old_tables.prefix_index.longest_prefix("DH1TW"), "") #old version is left untouched
+			self.assertEqual(database.tables.prefix_index.longest_prefix("DH1TW"), "DH")
+			with open(filename, "w") as f:
+				f.write("broken")
+			self.assertRaises(Exception, database.load)
+			self.assertEqual(len(database.tables), 2) #failed reloads keep the current version
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_country_file_formats(self):
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			dat_file = os.path.join(tmp_dir, "cty.dat")
+			with open(dat_file, "w") as f:
+				f.write("Fed. Rep. of Germany:     14:  28:  EU:   51.00:   -10.00:    -1.0:  DL:\n")
+				f.write("    DA,DB,DC,DD,DE,DF,DG,DH,DI,DJ,DK,DL,DM,DN,DO,DP,DQ,DR,=DA0HQ(14)[28],\n    =DL0IMD/LH;\n")
+				f.write("United States:            05:  08:  NA:   37.53:    91.67:     5.0:  K:\n")
+				f.write("    AA,K,N,W,W6(3)[6]<35.47/119.33>~8.0~,=K6SXA(4)[7]<30.92/97.37>~6.0~,=KL7/W6{OC};\n")
+			csv_file = os.path.join(tmp_dir, "cty.csv")
+			with open(csv_file, "w") as f:
+				f.write("DL,Fed. Rep. of Germany,230,EU,14,28,51.00,-10.00,-1.0,DA DB DC DD DE DF DG DH DI DJ DK DL DM DN DO DP DQ DR =DA0HQ(14)[28] =DL0IMD/LH;\n")
+				f.write("K,United States,291,NA,5,8,37.53,91.67,5.0,AA K N W W6(3)[6]<35.47/119.33>~8.0~ =K6SXA(4)[7]<30.92/97.37>~6.0~ =KL7/W6{OC};\n")
+			dat = load_cty(dat_file)
+			self.assertEqual(load_cty(csv_file), dat)
+			self.assertEqual(len(dat), 27)
+			self.assertEqual(dat["DH"], CtyEntry('Fed. Rep. of Germany', 14, 28, 'EU', 51.0, -10.0, -1.0, False))
+			self.assertEqual(dat["DH"]['Country'], 'Fed. Rep. of Germany')
+			self.assertEqual(dat["DH"].get('ExactCallsign'), False)
+			self.assertEqual(dat["W6"], Station.dxcc["W6"])
+			self.assertEqual(dat["K6SXA"], Station.dxcc["K6SXA"])
+			self.assertEqual(dat["DL0IMD/LH"]['ExactCallsign'], True)
+			self.assertEqual(dat["KL7/W6"]['Continent'], "OC")
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	def test_country_file_diff(self):
+		germany = CtyEntry('Germany', 14, 28, 'EU', 51.0, -10.0, -1.0, False)
+		usa = CtyEntry('United States', 5, 8, 'NA', 37.53, 91.67, 5.0, False)
+		old = {"DL": germany, "DH": germany, "K": usa}
+		new = {"DL": germany, "DH": germany._replace(cqz=15), "K": usa._replace(country='USA'), "DL1A": germany}
+		changes = diff_cty(old, new)
+		self.assertEqual(len(changes), 3)
+		self.assertEqual(list(changes.added), ["DL1A"])
+		self.assertEqual(changes.country_changes(), [("K", "United States", "USA")])
+		self.assertEqual(changes.zone_changes(), [("DH", (14, 28), (15, 28))])
+		self.assertEqual(changes.report(), ["added DL1A (Germany)", "changed DH: CQZone 14 -> 15", "changed K: Country United States -> USA"])
+		self.assertEqual(changes.affects("DH1TW", "DH"), True)
+		self.assertEqual(changes.affects("DL1ABC", "DL"), True) #DL1A is a longer match now
+		self.assertEqual(changes.affects("DL2AB", "D"), True)
+		self.assertEqual(changes.affects("EA4/DH1TW/M", "EA"), False)
+		old = {"K": usa, "K6SXA": usa._replace(exact=True)}
+		changes = diff_cty(old, {"K": usa, "K6SXA": usa}) #K6SXA is a prefix now, no longer an exact call
+		self.assertEqual(changes.new_prefixes(), ["K6SXA"])
+		self.assertEqual(changes.affects("K6SXAB", "K"), True)
+		self.assertEqual(changes.affects("K6SXA", "K6SXA"), True)
+		self.assertEqual(changes.affects("K1ABC", "K"), True) #K is a part of K6SXA
+		self.assertEqual(changes.affects("W1AW", "W"), False)
+
+		index = PrefixIndex(["DL", "DH", "K"])
+		updated = index.updated(added=["DL1A"], removed=["DH"])
+		self.assertEqual(updated.longest_prefix("DL1ABC"), "DL1A")
+		self.assertEqual(updated.longest_prefix("DH1TW"), "")
+		self.assertEqual(len(updated), 3)
+		self.assertEqual(index.longest_prefix("DL1ABC"), "DL") #the original index is left untouched
+		self.assertEqual(index.longest_prefix("DH1TW"), "DH")
+
+	def test_station_update_cty(self):
+		Station.reload_cty("cty.plist")
+		dh1tw = Station("DH1TW")
+		ea4 = Station("EA4/DH1TW/M")
+		changes = Station.update_cty("cty.plist")
+		self.assertEqual(len(changes), 0)
+		self.assertEqual(Station("DH1TW") is dh1tw, True) #unaffected stations stay in the cache
+		self.assertEqual(Station("EA4/DH1TW/M") is ea4, True)
+
+	def test_spot_convert_freq_to_band(self):
+		spot = Spot(fixture_spot1)
+		self.assertEqual(spot.convert_freq_to_band(1838), (160, "CW"))
+		self.assertEqual(spot.convert_freq_to_band(1838.5), (160, "DIGITAL"))
+		self.assertEqual(spot.convert_freq_to_band(14099.5), (20, "BEACON"))
+		self.assertEqual(spot.convert_freq_to_band(28250.0), (10, "BEACON"))
+		self.assertEqual(spot.convert_freq_to_band(50105.0), (6, "USB"))
+		self.assertEqual(spot.convert_freq_to_band(10368887.0), (0.03, "unknown"))
+		self.assertEqual(spot.convert_freq_to_band(234.0), (0, "unknown"))
+		self.assertEqual(spot.convert_freq_to_band(9330368887.0), (0, "unknown"))
+
+	def test_band_plan_regions(self):
+		self.assertEqual(load_band_plan(region="1").lookup(7250), (0, "unknown"))
+		self.assertEqual(load_band_plan(region="2").lookup(7250), (40, "LSB"))
+		self.assertRaises(ValueError, load_band_plan, region="4")
+		self.assertRaises(ValueError, BandPlan, [(14000, 14100, 20, "CW"), (14050, 14350, 20, "USB")])
+
+	@unittest.skipUnless(numpy, "NumPy is not installed")
+	def test_band_plan_lookup_array(self):
+		band_plan = load_band_plan()
+		bands, modes = band_plan.lookup_array(numpy.array([21004.8, 14099.5, 234.0, 144000.0]))
+		self.assertEqual(list(bands), [15, 20, 0, 2])
+		self.assertEqual([band_plan.modes[mode] for mode in modes], ["CW", "BEACON", "unknown", "CW"])
+
+	def test_parse_line_dispatch(self):
+		self.assertEqual(type(parse_line(fixture_spot1 + "\r\n")), Spot)
+		self.assertEqual(type(parse_line(fixture_wwv1)), WWV)
+		self.assertEqual(type(parse_line(fixture_wwv11)), WWV)
+		self.assertEqual(type(parse_line(fixture_comment_3)), Comment)
+		self.assertEqual(type(parse_line(fixture_spot1.encode("ascii"))), Spot)
+		self.assertEqual(parse_line("DH1TW de DK0WCY > "), None)
+		self.assertEqual(parse_line(""), None)
+
+	def test_parse_lines(self):
+		lines = [fixture_spot1 + "\n", "login: ", fixture_wwv11 + "\n", fixture_spot3 + "\n", fixture_comment_1 + "\n"]
+		records = list(parse_lines(iter(lines)))
+		self.assertEqual([type(record) for record in records], [Spot, WWV, Spot, Comment])
+		self.assertEqual(records[0].dx_call, "HC2AO")
+		self.assertEqual(records[2].valid, False)
+		records = list(parse_lines(lines, skip_invalid=True))
+		self.assertEqual([type(record) for record in records], [Spot, WWV, Comment])
+
+	@unittest.skipUnless(asyncio, "asyncio is not available")
+	def test_cluster_connection_with_reconnect(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		fake_cluster = FakeCluster([[fixture_spot1, fixture_wwv11, "DH1TW de FAKE >"], [fixture_comment_1, fixture_spot3]])
+		try:
+			port = fake_cluster.start(loop)
+			connection = ClusterConnection("127.0.0.1", port, "DH1TW", min_backoff=0.01, max_backoff=0.05, skip_invalid=True)
+			task = connection.start()
+			records = [loop.run_until_complete(asyncio.wait_for(connection.queue.get(), 5)) for i in range(3)]
+			connection.close()
+			loop.run_until_complete(asyncio.wait_for(task, 5))
+			self.assertRaises(StopAsyncIteration, loop.run_until_complete, connection.__anext__())
+			self.assertEqual([type(record) for record in records], [Spot, WWV, Comment])
+			self.assertEqual(records[0].dx_call, "HC2AO")
+			self.assertEqual(records[2].text, "UA4WHX pse beaming south")
+			self.assertEqual(fake_cluster.received[:2], [b"DH1TW\r\n", b"DH1TW\r\n"])
+			self.assertEqual(connection.connects >= 2, True)
+		finally:
+			fake_cluster.stop(loop)
+			loop.close()
+			asyncio.set_event_loop(None)
+
+	@unittest.skipUnless(asyncio, "asyncio is not available")
+	def test_cluster_telnet_command_split_across_reads(self):
+		loop = asyncio.new_event_loop()
+		asyncio.set_event_loop(loop)
+		#the first packet ends with IAC, the next one starts with WILL ECHO
+		fake_cluster = FakeCluster([[b"\r\n\r\n\r\n\xff\xfb\x01", fixture_comment_1,
+			fixture_spot1[:40].encode("ascii") + b"\xff\xfd\x03" + fixture_spot1[40:].encode("ascii") + b"\r\n"]], delay=0.02)
+		try:
+			port = fake_cluster.start(loop)
+			connection = ClusterConnection("127.0.0.1", port, "DH1TW", min_backoff=0.01, max_backoff=0.05)
+			task = connection.start()
+			records = [loop.run_until_complete(asyncio.wait_for(connection.queue.get(), 5)) for i in range(2)]
+			connection.close()
+			loop.run_until_complete(asyncio.wait_for(task, 5))
+			self.assertEqual([type(record) for record in records], [Comment, Spot])
+			self.assertEqual(records[0].text, "UA4WHX pse beaming south")
+			self.assertEqual((records[1].dx_call, records[1].comment, records[1].valid), ("HC2AO", Spot(fixture_spot1).comment, True))
+		finally:
+			fake_cluster.stop(loop)
+			loop.close()
+			asyncio.set_event_loop(None)
+
+	@unittest.skipUnless(bulk, "concurrent.futures is not available")
+	def test_bulk_decode_file(self):
+		lines = [fixture_spot1, fixture_wwv1, fixture_spot2, fixture_spot3, fixture_spot5, fixture_comment_1, fixture_spot6, fixture_spot7] * 25
+		tmp_dir = tempfile.mkdtemp()
+		try:
+			input_file = os.path.join(tmp_dir, "cluster.log")
+			output_file = os.path.join(tmp_dir, "spots.tsv")
+			with open(input_file, "w") as f:
+				f.write("\n".join(lines))
+			shards = bulk.shard_offsets(input_file, 500)
+			self.assertEqual(shards[0][0], 0)
+			self.assertEqual(shards[-1][1], os.path.getsize(input_file))
+			self.assertEqual(len(shards) > 10, True)
+			counters = bulk.decode_file(input_file, output_file, workers=2, shard_size=500)
+			self.assertEqual(counters["lines"], len(lines))
+			self.assertEqual(counters["spots"], 125)
+			self.assertEqual(counters["invalid"], 25)
+			self.assertEqual(counters["skipped"], 50)
+			expected = [bulk.format_spot(record) for record in parse_lines(lines, skip_invalid=True) if isinstance(record, Spot)]
+			with open(output_file) as f:
+				self.assertEqual(f.readline(), "\t".join(bulk.SPOT_COLUMNS) + "\n")
+				self.assertEqual(f.readlines(), expected)
+		finally:
+			shutil.rmtree(tmp_dir)
+
+	@unittest.skipUnless(columnar, "NumPy is not installed")
+	def test_columnar_decode(self):
+		lines = [fixture_spot1, fixture_wwv1, fixture_spot2, fixture_spot3, fixture_spot5, fixture_comment_1, fixture_spot6, fixture_spot7, fixture_spot8, "DX de"]
+		spots = [record for record in parse_lines(lines) if isinstance(record, Spot) and record.dx_station is not None]
+		columns = columnar.decode_lines(lines)
+		self.assertEqual(len(columns), len(spots))
+		self.assertEqual(columns.skipped, 1) #"DX de"
+		for i, spot in enumerate(spots):
+			self.assertEqual(columns.calls[columns["dx_call"][i]], spot.dx_call)
+			self.assertEqual(columns.calls[columns["spotter_call"][i]], spot.spotter_call)
+			self.assertEqual(columns["frequency"][i], spot.frequency)
+			self.assertEqual(columns["band"][i], spot.band)
+			self.assertEqual(columns.modes[columns["mode"][i]], spot.mode)
+			self.assertEqual(columns["valid"][i], spot.valid)
+		self.assertEqual(str(columns["time"][0])[-5:], "21:32")
+		self.assertEqual(columns.tables.entities[columns["dx_entity"][0]].country, "Ecuador")
+		self.assertEqual((columns["dx_cqz"][0], columns["dx_ituz"][0]), (10, 12))
+		self.assertEqual(columns.continents[columns["spotter_continent"][0]], "AF")
+		self.assertEqual(columns["dx_entity"][2], -1) #IDIOT
+		self.assertEqual(columns["spotter_call"][0], columns["spotter_call"][2]) #CT3FW is stored once
+		distance, bearing = columns.paths()
+		self.assertEqual((round(distance[0], 6), round(bearing[0], 6)), tuple(round(value, 6) for value in spots[0].path))
+		self.assertEqual(numpy.isnan(distance[2]), True) #IDIOT
+
+	def test_spot_aggregator(self):
+		spots = make_spots([("DH1TW:", 14025.0, "HC2AO", 1200), ("CT3FW:", 14025.3, "HC2AO", 1201), ("DH1TW:", 14024.6, "HC2AO", 1202),
+			("W3LPL:", 14025.1, "HC2AO", 1203), ("DH1TW:", 14030.0, "HC2AO", 1203), ("DH1TW:", 21004.8, "VP2E", 1205),
+			("CT3FW:", 14025.0, "HC2AO", 1220)], date(2014, 1, 25))
+		closed = []
+		aggregator = SpotAggregator(window=600, tolerance=1.0, on_close=closed.append)
+		self.assertEqual(list(aggregator.dedup(spots[:6])), [spots[0], spots[4], spots[5]])
+		self.assertEqual(len(aggregator), 3)
+		self.assertEqual(aggregator.duplicates, 3)
+		activity = list(aggregator)[0]
+		self.assertEqual((activity.dx_call, activity.frequency, activity.count), ("HC2AO", 14025.0, 4))
+		self.assertEqual(activity.spotters, set(["DH1TW", "CT3FW", "W3LPL"]))
+		self.assertEqual(activity.continents, {"EU": 1, "AF": 1, "NA": 1})
+		self.assertEqual(activity.last_seen - activity.first_seen, timedelta(minutes=3))
+		self.assertEqual(aggregator.add(spots[6]).count, 1) #12:20 is more than 10 minutes after the last spot
+		self.assertEqual([activity.frequency for activity in closed], [14025.0, 14030.0, 21004.8])
+		self.assertEqual(len(aggregator.flush()), 1)
+		self.assertEqual(aggregator.add(Spot(fixture_spot3)), None) #invalid
+
+	def test_spot_store(self):
+		spots = make_spots([("DH1TW:", 14025.0, "HC2AO", 1200), ("W3LPL:", 14025.1, "DH1TW", 1201), ("DH1TW:", 7012.0, "HC2AO", 1202),
+			("DK7UK:", 14205.0, "UR8EW", 1210), ("DH1TW:", 14003.0, "VP2E", 1215), ("DK7UK:", 14002.5, "HC2AO", 1216)], date(2014, 1, 25))
+		store = SpotStore(capacity=5)
+		self.assertEqual([store.add(spot) for spot in spots], [0, 1, 2, 3, 4, 5])
+		self.assertEqual(store.add(Spot(fixture_spot3)), None) #invalid
+		self.assertEqual(len(store), 5) #the first spot has been dropped
+		self.assertEqual(store.query(band=20, mode="CW", spotter_continent="EU", spotter_cqz=14), [spots[5], spots[4]])
+		self.assertEqual(store.query(dx_call="HC2AO"), [spots[5], spots[2]])
+		self.assertEqual(store.query(band=(20, 40), spotter_country="Fed. Rep. of Germany", limit=2), [spots[5], spots[4]])
+		self.assertEqual(store.query(band=20, since=timedelta(minutes=5)), [spots[5], spots[4]])
+		self.assertEqual(store.query(since=datetime(2014, 1, 25, 12, 10, tzinfo=UTC)), [spots[5], spots[4], spots[3]])
+		self.assertEqual(store.query(band=160), [])
+		self.assertEqual(store.count("dx_continent"), {"SA": 2, "EU": 2, "NA": 1})
+		self.assertRaises(ValueError, store.query, locator="JO62")
+		store.expire(datetime(2014, 1, 25, 12, 15, tzinfo=UTC))
+		self.assertEqual(list(store), [spots[4], spots[5]])
+		self.assertEqual(store.indexes["dx_call"], {"VP2E": set([4]), "HC2AO": set([5])})
+
+	def test_great_circle_paths(self):
+		distance, bearing = great_circle(51.0, 10.0, 40.7, -74.0)
+		self.assertEqual((round(distance), round(bearing)), (6246, 295))
+		distance, bearing = great_circle(0.0, 0.0, 0.0, 90.0)
+		self.assertEqual((round(distance, 3), bearing), (round(EARTH_RADIUS * math.pi / 2, 3), 90.0))
+		self.assertEqual(locator_to_position("JO70"), (50.5, 15.0))
+		self.assertEqual(locator_to_position("jn48qt"), (48.8125, 9.375))
+		self.assertEqual(locator_to_position("FN42A"), (42.5, -71.0))
+		self.assertEqual(locator_to_position("ZZ00"), None)
+		spot = Spot(fixture_spot1)
+		spotter, dx = spot.spotter_station, spot.dx_station
+		self.assertEqual(spot.path, great_circle(spotter.latitude, -spotter.longitude, dx.latitude, -dx.longitude))
+		self.assertEqual(Spot(fixture_spot3).path, None)
+		matrix = path_matrix(Station.database.tables)
+		self.assertEqual(matrix.path(spotter.cty_info, dx.cty_info) is Spot(fixture_spot1).path, True) #computed once
+		with_locator = Spot("DX de OK1TEH:   144000.0  DH1TW        tnx                            1328Z JO70")
+		self.assertEqual(with_locator.path, great_circle(50.5, 15.0, 51.0, 10.0))
+		self.assertEqual(round(with_locator.distance), 356)
+		self.assertEqual(round(with_locator.bearing), 281)
+
+	def test_locators(self):
+		self.assertEqual(locator_to_position("IM98"), (38.5, -1.0))
+		latitude, longitude = locator_to_position("JO62QM25")
+		self.assertAlmostEqual(latitude, 52 + 12 / 24.0 + 5.5 / 240.0)
+		self.assertAlmostEqual(longitude, 12 + 16 / 12.0 + 2.5 / 120.0)
+		hits = locator_cache.hits
+		self.assertEqual(locator_to_position("IM98"), (38.5, -1.0))
+		self.assertEqual(locator_cache.hits, hits + 1)
+		self.assertEqual(locator_to_position("XX99"), None)
+		self.assertEqual(locator_to_position("XX99"), None) #invalid locators are cached too
+		info = Spot(fixture_spot5).locators #"JN48QT<ES>IM98 QRP 5W LOOP ANT"
+		self.assertEqual((info.locators, info.mode), (("JN48QT", "IM98"), "ES"))
+		self.assertEqual((info.source, info.destination), ((48.8125, 9.375), (38.5, -1.0)))
+		info = comment_locators("tnx jo62qm<TR>JO70, 59")
+		self.assertEqual((info.locators, info.mode, info.destination), (("JO62QM", "JO70"), "TR", (50.5, 15.0)))
+		self.assertEqual(comment_locators("599 TKS(CW)QSL READ,QRZ.COM"), (tuple(), None, None, None))
+		self.assertEqual(Spot(fixture_spot4).locator_position, (50.5, 15.0)) #JO70
+		self.assertEqual(Spot(fixture_spot1).locator_position, None)
+
+	def test_pipeline_metrics(self):
+		before = dict((metric.name, dict(metric.values)) for metric in (metrics.records, metrics.errors, metrics.stations))
+		def delta(metric, key):
+			return(metric.get(key) - before[metric.name].get(key, 0))
+		timing = Spot.timing
+		Spot.timing = 1
+		try:
+			split = metrics.stage_seconds.get("split")
+			Spot(fixture_spot1)
+			self.assertEqual(metrics.stage_seconds.get("split"), split + 1)
+		finally:
+			Spot.timing = timing
+		Spot(fixture_spot3) #IDIOT
+		Station("DL9MET/MM")
+		WWV(fixture_wwv_invalid_2)
+		Comment(fixture_comment_invalid_2)
+		parse_line("login: ")
+		self.assertEqual(delta(metrics.records, ("spot", "valid")), 1)
+		self.assertEqual(delta(metrics.records, ("spot", "invalid")), 1)
+		self.assertEqual(delta(metrics.errors, ("spot", "dx_station")), 1)
+		self.assertEqual(delta(metrics.errors, ("station", "maritime_mobile")), 1)
+		self.assertEqual(delta(metrics.stations, "invalid") >= 1, True)
+		self.assertEqual(delta(metrics.errors, ("wwv", "type")), 1)
+		self.assertEqual(delta(metrics.errors, ("comment", "station")), 1)
+		self.assertEqual(delta(metrics.records, ("other", "ignored")), 1)
+
+		registry = Metrics("test")
+		errors = registry.counter("errors", "errors by reason", ("type", "reason"))
+		latency = registry.histogram("latency_seconds", "latency", ("stage",), buckets=(0.001, 0.01))
+		errors.inc(("spot", "time"))
+		errors.inc(("spot", "time"))
+		for seconds in (0.0005, 0.002, 0.02):
+			latency.observe("split", seconds)
+		self.assertEqual(registry.as_dict()["errors"], {"spot/time": 2})
+		self.assertEqual(registry.as_dict()["latency_seconds"]["split"]["buckets"], {"0.001": 1, "0.01": 2, "+Inf": 3})
+		self.assertEqual(latency.quantile("split", 0.5), 0.01)
+		text = registry.prometheus().splitlines()
+		self.assertEqual("# TYPE test_errors_total counter" in text, True)
+		self.assertEqual('test_errors_total{type="spot",reason="time"} 2' in text, True)
+		self.assertEqual('test_latency_seconds_bucket{stage="split",le="0.01"} 2' in text, True)
+		self.assertEqual('test_latency_seconds_count{stage="split"} 3' in text, True)
+		registry.reset()
+		self.assertEqual(errors.get(("spot", "time")), 0)
+
+	def test_profiling_hooks(self):
+		original = Station.__dict__["obtain_prefix"]
+		calls = []
+		hook = lambda stage, seconds, instance, args: calls.append((stage, args[0]))
+		profiling.add_hook("obtain_prefix", hook)
+		profiling.add_hook("convert_freq_to_band", hook)
+		try:
+			self.assertEqual(Station.__dict__["obtain_prefix"] is original, False)
+			Station.cache.clear()
+			Spot(fixture_spot1)
+			self.assertEqual(calls, [("convert_freq_to_band", 21004.8), ("obtain_prefix", "HC2AO"), ("obtain_prefix", "CT3FW")])
+		finally:
+			profiling.remove_all_hooks()
+		self.assertEqual(Station.__dict__["obtain_prefix"] is original, True) #no cost without hooks
+		self.assertRaises(ValueError, profiling.add_hook, "decode", hook)
+
+		with profiling.SlowestInputs(size=2, capacity=3) as slowest:
+			for call in ("DH1TW", "DL9XYZ/P", "VP5/DL9XYZ", "9K2/K2SES", "EA5/ON4CAU"):
+				Station.cache.pop(call)
+				Station(call)
+		self.assertEqual(profiling._originals, {}) #all stages unwrapped again
+		self.assertEqual(len(slowest.inputs) <= 3, True)
+		report = slowest.slowest()
+		self.assertEqual(len(report), 2)
+		self.assertEqual(report[0][1] >= report[1][1], True)
+		self.assertEqual(set(report[0][2]), set(profiling.STATION_STAGES))
+		self.assertEqual(slowest.report().splitlines()[1].startswith(report[0][0]), True)
+
+	def test_results_are_immutable_and_shared(self):
+		station = Station("DH1TW")
+		self.assertEqual(Station("DH1TW") is station, True)
+		self.assertEqual(Station("DH2AB").cty_info is station.cty_info, True)
+		self.assertEqual(hasattr(station, "__dict__"), False)
+		self.assertRaises(AttributeError, setattr, station, "valid", False)
+		self.assertRaises(AttributeError, setattr, Spot(fixture_spot1), "band", 20)
+		self.assertRaises(AttributeError, setattr, WWV(fixture_wwv1), "a", 1)
+		self.assertRaises(AttributeError, setattr, Comment(fixture_comment_1), "text", "")
+		self.assertEqual(Station("QSL").cty_info, None)
+		self.assertEqual(Station("QSL").country, None)
+
+	def test_pickle_and_copy(self):
+		for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+			spot = pickle.loads(pickle.dumps(Spot(fixture_spot1), protocol))
+			self.assertEqual((spot.dx_call, spot.frequency, spot.band, spot.time, spot.valid), ("HC2AO", 21004.8, 15, fixture_spot1_time, True))
+			self.assertEqual(spot.dx_station is Station("HC2AO"), True) #stations are taken from the cache
+			self.assertRaises(AttributeError, setattr, spot, "band", 20)
+			wwv = pickle.loads(pickle.dumps(WWV(fixture_wwv11), protocol))
+			self.assertEqual((wwv.station.call, wwv.a, wwv.k, wwv.valid), ("DK0WCY-2", 23, 3, True))
+			comment = pickle.loads(pickle.dumps(Comment(fixture_comment_1), protocol))
+			self.assertEqual((comment.station.call, comment.text, comment.valid), ("IK8CNT", "UA4WHX pse beaming south", True))
+		station = Station("DH1TW/P")
+		self.assertEqual(pickle.loads(pickle.dumps(station)) is station, True)
+		self.assertEqual(copy.copy(station) is station, True)
+		spot = Spot(fixture_spot5)
+		self.assertEqual(copy.copy(spot).comment, spot.comment)
+		self.assertEqual(copy.deepcopy(spot).dx_station.country, spot.dx_station.country)
+
 if __name__ == "__main__": 
 	#unittest.main()
 	suite = unittest.TestLoader().loadTestsFromTestCase(TestSequenceFunctions)
@@ -0,0 +1,96 @@
+#!/usr/bin/python
+# Filename: timestamps.py
+
+import time
+from datetime import datetime, timedelta
+import pytz
+
+#------------------CONSTANTS --------------------
+UTC = pytz.utc
+EPOCH = datetime(1970, 1, 1, tzinfo=UTC)
+EPOCH_ORDINAL = EPOCH.toordinal()
+SECONDS_PER_DAY = 86400
+MINUTES_PER_DAY = 1440
+MAX_CLOCK_SKEW = 300 #seconds; spots may be this far ahead of the reference clock and still belong to today
+ROLLOVER = 720 #minutes; a jump back in time by more than this starts a new day when replaying an archive
+
+class TimestampResolver(object):
+	""" Turns the time of a spot (hour and minute UTC, without date) into a datetime.
+
+	Live (default): the date is taken from a reference clock (clock() returns POSIX seconds,
+	default time.time). A time which lies ahead of the clock by more than max_skew belongs
+	to the previous day, e.g. a 2359Z spot which is processed at 00:01.
+
+	Archive (date=...): the spots are expected in the order of the archive, the first one
+	is dated with date. Whenever the time jumps back by more than rollover minutes (2359Z
+	followed by 0001Z) the next day begins; a time which jumps ahead by more than rollover
+	minutes is a late spot of the previous day. Gaps of more than a day can't be detected.
+
+	The datetime objects are cached per minute of the current and the previous day, so a
+	resolve() costs some integer arithmetic and a list lookup; the returned objects are shared"""
+
+	def __init__(self, date=None, clock=time.time, max_skew=MAX_CLOCK_SKEW, rollover=ROLLOVER):
+		self.clock = clock
+		self.max_skew = max_skew
+		self.rollover = rollover
+		self.archive = date is not None
+		self._day = None #days since the epoch of self._today
+		self._midnight = 0 #POSIX seconds at the beginning of self._day
+		self._today = None #cached datetime objects, one per minute of the day
+		self._yesterday = None
+		self._last = None #minute of the day of the last resolved spot (archive)
+		if date is not None:
+			self._set_day(date.toordinal() - EPOCH_ORDINAL)
+
+	@property
+	def day(self):
+		"""date of the current day"""
+		return(None if self._day is None else (EPOCH + timedelta(days=self._day)).date())
+
+	def resolve(self, hour, minute=0):
+		"""datetime (UTC) of a spot at hour:minute; raises ValueError for an invalid time"""
+		if not (0 <= hour < 24 and 0 <= minute < 60):
+			raise ValueError("invalid time %s:%s" % (hour, minute))
+		minute_of_day = hour * 60 + minute
+		day = self._resolve_day(minute_of_day)
+		if day == self._day:
+			stamps = self._today
+		else:
+			if self._yesterday is None:
+				self._yesterday = [None] * MINUTES_PER_DAY
+			stamps = self._yesterday
+		stamp = stamps[minute_of_day]
+		if stamp is None:
+			stamp = stamps[minute_of_day] = EPOCH + timedelta(days=day, minutes=minute_of_day)
+		return(stamp)
+
+	def days(self, minutes):
+		"""days since the epoch for a sequence of minutes of the day (e.g. the spots of an archive)"""
+		return([self._resolve_day(minute_of_day) for minute_of_day in minutes])
+
+	def _resolve_day(self, minute_of_day):
+		if self.archive:
+			last = self._last
+			if last is not None:
+				if minute_of_day < last - self.rollover:
+					self._set_day(self._day + 1)
+				elif minute_of_day > last + self.rollover:
+					return(self._day - 1) #late spot from before midnight
+			self._last = minute_of_day
+			return(self._day)
+		seconds = self.clock() - self._midnight
+		if self._day is None or not 0 <= seconds < SECONDS_PER_DAY:
+			now = self.clock()
+			self._set_day(int(now // SECONDS_PER_DAY))
+			seconds = now - self._midnight
+		if minute_of_day * 60 > seconds + self.max_skew:
+			return(self._day - 1)
+		return(self._day)
+
+	def _set_day(self, day):
+		self._yesterday = self._today if self._day == day - 1 else None
+		self._day = day
+		self._midnight = day * SECONDS_PER_DAY
+		self._today = [None] * MINUTES_PER_DAY
+
+# End of timestamps.py